@@ -1,4 +1,5 @@
 from celery import Celery
+from celery.schedules import crontab
 from app.core.config.settings import settings
 
 BROKER = settings.CELERY_BROKER_URL
@@ -8,7 +9,26 @@ BACKEND = settings.CELERY_RESULT_BACKEND
 def make_celery(app_name=__name__):
     backend = BACKEND
     broker = BROKER
-    return Celery(app_name, backend=backend, broker=broker, broker_connection_retry_on_startup=True)
+    return Celery(
+        app_name,
+        backend=backend,
+        broker=broker,
+        include=["app.services.tasks"],
+        broker_connection_retry_on_startup=True,
+    )
 
 
 celery_app = make_celery()
+
+if settings.CELERY_WORKER_MODE == "async":
+    # tasks block a pool thread only while their coroutine runs on the worker's shared event loop,
+    # see app/services/tasks.py
+    celery_app.conf.worker_pool = "threads"
+    celery_app.conf.worker_concurrency = settings.CELERY_ASYNC_CONCURRENCY
+
+
+if settings.ANALYTICS_RETENTION_DAYS:
+    # run with `celery -A app.celery beat`
+    celery_app.conf.beat_schedule = {
+        "compact-analytics": {"task": "app.services.tasks.compact_analytics", "schedule": crontab(hour=3, minute=0)},
+    }
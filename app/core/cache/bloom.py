@@ -0,0 +1,122 @@
+import hashlib
+import math
+from typing import Any, AsyncIterable
+
+from redis.asyncio import Redis
+
+from app.core.cache.redis import redis
+from app.core.config.settings import settings
+from app.core.logging import log_this
+
+# Bits are only ever set, an item written while a rebuild is in flight also lands in the
+# rebuild key so the rename at the end of `rebuild` can not lose it. The live key is never created
+# here, a filter holding only the newest items would reject every older one.
+ADD_SCRIPT = """
+local live = redis.call('EXISTS', KEYS[1]) == 1
+local rebuilding = redis.call('EXISTS', KEYS[2]) == 1
+for _, offset in ipairs(ARGV) do
+    if live then
+        redis.call('SETBIT', KEYS[1], offset, 1)
+    end
+    if rebuilding then
+        redis.call('SETBIT', KEYS[2], offset, 1)
+    end
+end
+return 1
+"""
+
+# A filter that has not been built yet must not reject anything.
+CHECK_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 1
+end
+for _, offset in ipairs(ARGV) do
+    if redis.call('GETBIT', KEYS[1], offset) == 0 then
+        return 0
+    end
+end
+return 1
+"""
+
+
+class RedisBloomFilter:
+    """
+    Bloom filter stored as a Redis bitmap so every worker shares the same view.
+
+    `might_contain` never gives false negatives, a `False` answer means the item was never added.
+    """
+
+    def __init__(self, redis: Redis, key: str, capacity: int, error_rate: float):
+        self.redis = redis
+        self.key = key
+        self.rebuild_key = f"{key}:rebuild"
+        self.lock_key = f"{key}:lock"
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._add = redis.register_script(ADD_SCRIPT)
+        self._check = redis.register_script(CHECK_SCRIPT)
+        self.checks = 0
+        self.rejections = 0
+
+    def _offsets(self, item: str) -> list[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    async def might_contain(self, item: str) -> bool:
+        self.checks += 1
+        present = bool(await self._check(keys=[self.key], args=self._offsets(item)))
+        if not present:
+            self.rejections += 1
+        return present
+
+    async def add(self, *items: str) -> None:
+        if not items:
+            return
+        offsets = [offset for item in items for offset in self._offsets(item)]
+        await self._add(keys=[self.key, self.rebuild_key], args=offsets)
+
+    async def rebuild(self, items: AsyncIterable[str], batch_size: int = 1000) -> bool:
+        """
+        Rebuilds the filter from `items` and swaps it in atomically.
+
+        Only one worker rebuilds at a time, returns False if another one holds the lock.
+        """
+        if not await self.redis.set(self.lock_key, 1, nx=True, ex=600):
+            return False
+        try:
+            log_this(f"Rebuilding bloom filter {self.key}")
+            await self.redis.delete(self.rebuild_key)
+            await self.redis.setbit(self.rebuild_key, self.size - 1, 0)
+            count = 0
+            pipe = self.redis.pipeline(transaction=False)
+            async for item in items:
+                for offset in self._offsets(item):
+                    pipe.setbit(self.rebuild_key, offset, 1)
+                count += 1
+                if count % batch_size == 0:
+                    await pipe.execute()
+            await pipe.execute()
+            await self.redis.rename(self.rebuild_key, self.key)
+            log_this(f"Rebuilt bloom filter {self.key} with {count} items", "DONE")
+            return True
+        finally:
+            await self.redis.delete(self.rebuild_key, self.lock_key)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "error_rate": self.error_rate,
+            "bits": self.size,
+            "hashes": self.hashes,
+            "checks": self.checks,
+            "rejections": self.rejections,
+        }
+
+
+short_url_bloom = RedisBloomFilter(
+    redis, "bloom:short_urls", settings.SHORT_URL_BLOOM_CAPACITY, settings.SHORT_URL_BLOOM_ERROR_RATE
+)
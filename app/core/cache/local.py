@@ -0,0 +1,115 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any
+
+from redis.asyncio import Redis
+
+from app.core.config.settings import settings
+from app.core.logging import log_this
+
+INVALIDATION_CHANNEL = "url:invalidate"
+
+
+class TTLCache:
+    """
+    Bounded in-process LRU cache whose entries expire after `ttl` seconds.
+
+    Not safe to share across processes, every worker keeps its own copy and
+    relies on `publish_invalidation` to drop entries that changed elsewhere.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Any | None:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *keys: str) -> None:
+        for key in keys:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+redirect_cache = TTLCache(settings.REDIRECT_CACHE_SIZE, settings.REDIRECT_CACHE_TTL)
+
+
+async def publish_invalidation(redis: Redis, *short_urls: str) -> None:
+    """
+    Drops the given short links from this worker's cache and tells every other worker to do the same.
+    """
+    redirect_cache.invalidate(*short_urls)
+    for short_url in short_urls:
+        await redis.publish(INVALIDATION_CHANNEL, short_url)
+
+
+async def listen_for_invalidations(redis: Redis) -> None:
+    """
+    Long running task that evicts cached redirects announced on `INVALIDATION_CHANNEL`.
+
+    If the subscription drops, the whole cache is cleared before resubscribing since
+    messages published in the meantime are lost, entries would otherwise live until their TTL.
+    """
+    while True:
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    redirect_cache.invalidate(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log_this(f"Redirect cache invalidation listener failed, retrying. {e}", "WARNING")
+            redirect_cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
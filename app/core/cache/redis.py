@@ -1,4 +1,9 @@
-from redis.asyncio import Redis
+import time
+from typing import Any
+
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.exceptions import ConnectionError
+
 from app.core.config.settings import settings
 
 
@@ -7,10 +12,58 @@ REDIS_PORT = settings.REDIS_PORT
 REDIS_PASSWORD = settings.REDIS_PASS
 REDIS_USERNAME = settings.REDIS_USER
 
-redis = Redis(
+
+class InstrumentedConnectionPool(BlockingConnectionPool):
+    """
+    Blocking connection pool that records utilisation and how long callers wait for a connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_use = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def get_connection(self, command_name, *keys, **options):
+        start = time.perf_counter()
+        try:
+            connection = await super().get_connection(command_name, *keys, **options)
+        except ConnectionError:
+            self.timeouts += 1
+            raise
+        wait = time.perf_counter() - start
+        self.in_use += 1
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        return connection
+
+    async def release(self, connection):
+        await super().release(connection)
+        self.in_use -= 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "max_connections": self.max_connections,
+            "in_use": self.in_use,
+            "utilisation": self.in_use / self.max_connections,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": self.total_wait / self.checkouts * 1000 if self.checkouts else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+redis_pool = InstrumentedConnectionPool(
+    max_connections=settings.REDIS_POOL_SIZE,
+    timeout=settings.REDIS_POOL_TIMEOUT,
     host=REDIS_HOST,
     port=REDIS_PORT,
     username=REDIS_USERNAME,
     password=REDIS_PASSWORD,
     decode_responses=True,
 )
+
+redis = Redis(connection_pool=redis_pool)
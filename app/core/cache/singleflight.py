@@ -0,0 +1,45 @@
+import asyncio
+from typing import Any, Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one execution within a worker.
+
+    Callers that arrive while a call for their key is in flight await its result instead of
+    running `fn` themselves. The shared call is shielded so a cancelled caller does not cancel it
+    for everyone else.
+    """
+
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.calls = 0
+        self.executions = 0
+        self.collapsed = 0
+        self.remote_collapsed = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        self.calls += 1
+        future = self._inflight.get(key)
+        if future is None:
+            self.executions += 1
+            future = asyncio.ensure_future(fn())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.collapsed += 1
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "in_flight": len(self._inflight),
+            "calls": self.calls,
+            "executions": self.executions,
+            "collapsed": self.collapsed,
+            "remote_collapsed": self.remote_collapsed,
+        }
+
+
+url_lookups = SingleFlight()
@@ -0,0 +1,21 @@
+from typing import Any
+
+from app.core.cache.redis import redis, redis_pool
+from app.core.logging import log_this
+from app.db.database import db, mongo_client, mongo_pool_metrics
+
+__all__ = ["redis", "db", "close_clients", "pool_stats"]
+
+
+def pool_stats() -> dict[str, Any]:
+    return {"redis": redis_pool.stats(), "mongo": mongo_pool_metrics.stats()}
+
+
+async def close_clients() -> None:
+    """
+    Closes the shared Redis and Mongo pools, called once on application or worker shutdown.
+    """
+    await redis.aclose()
+    await redis_pool.disconnect()
+    mongo_client.close()
+    log_this("Closed Redis and Mongo connection pools.", "DONE")
@@ -1,4 +1,5 @@
 import os
+from typing import Literal
 from xxlimited import Str
 from fastapi.datastructures import URL
 
@@ -24,13 +25,66 @@ class AppSettings(BaseSettings):
 class CelerySettings(BaseSettings):
     CELERY_BROKER_URL: str = config("CELERY_BROKER_URL", default="redis://redis:6379/0")
     CELERY_RESULT_BACKEND: str = config("CELERY_RESULT_BACKEND", default="redis://redis:6379/0")
+    CELERY_WORKER_MODE: Literal["prefork", "async"] = config("CELERY_WORKER_MODE", default="prefork")
+    CELERY_ASYNC_CONCURRENCY: int = config("CELERY_ASYNC_CONCURRENCY", default=64)
 
 class AnalyticsSettings(BaseSettings):
     AGGREGATION_INTERVAL : int = config("AGGREGATION_INTERVAL", default=60) # in minutes
+    ANALYTICS_STALE_BUDGET: int = config("ANALYTICS_STALE_BUDGET", default=24 * 60) # in minutes
+    ANALYTICS_REFRESH_LOCK_TTL: int = config("ANALYTICS_REFRESH_LOCK_TTL", default=30000) # in milliseconds
+    ANALYTICS_MAX_TIMELINE_BUCKETS: int = config("ANALYTICS_MAX_TIMELINE_BUCKETS", default=10000)
+    ANALYTICS_FULL_RECOMPUTE_INTERVAL: int = config("ANALYTICS_FULL_RECOMPUTE_INTERVAL", default=24 * 60) # in minutes
+    ANALYTICS_INGESTION_LAG: int = config("ANALYTICS_INGESTION_LAG", default=60) # in seconds
+    ANALYTICS_AGGREGATION_MODE: Literal["rollups", "facet", "concurrent"] = config(
+        "ANALYTICS_AGGREGATION_MODE", default="rollups"
+    )
+    CLICK_INGESTION_MODE: Literal["celery", "buffer", "stream"] = config("CLICK_INGESTION_MODE", default="celery")
+    CLICK_BUFFER_BATCH_SIZE: int = config("CLICK_BUFFER_BATCH_SIZE", default=500)
+    CLICK_BUFFER_FLUSH_INTERVAL: int = config("CLICK_BUFFER_FLUSH_INTERVAL", default=250) # in milliseconds
+    CLICK_BUFFER_MAX_SIZE: int = config("CLICK_BUFFER_MAX_SIZE", default=10000)
+    CLICK_BUFFER_OVERFLOW: Literal["drop", "spill"] = config("CLICK_BUFFER_OVERFLOW", default="spill")
+    CLICK_BUFFER_FLUSH_RETRIES: int = config("CLICK_BUFFER_FLUSH_RETRIES", default=3)
+    CLICK_STREAM_KEY: str = config("CLICK_STREAM_KEY", default="stream:clicks")
+    CLICK_STREAM_GROUP: str = config("CLICK_STREAM_GROUP", default="analytics")
+    CLICK_STREAM_MAXLEN: int = config("CLICK_STREAM_MAXLEN", default=1_000_000)
+    CLICK_STREAM_BATCH_SIZE: int = config("CLICK_STREAM_BATCH_SIZE", default=1000)
+    CLICK_STREAM_BLOCK: int = config("CLICK_STREAM_BLOCK", default=1000) # in milliseconds
+    CLICK_STREAM_CLAIM_IDLE: int = config("CLICK_STREAM_CLAIM_IDLE", default=60000) # in milliseconds
+    CLICK_STREAM_MAX_DELIVERIES: int = config("CLICK_STREAM_MAX_DELIVERIES", default=5)
+    GEOIP_DB_PATH: str | None = config("GEOIP_DB_PATH", default="data/GeoLite2-City.mmdb")
+    GEOIP_ASN_DB_PATH: str | None = config("GEOIP_ASN_DB_PATH", default="data/GeoLite2-ASN.mmdb")
+    GEOIP_CACHE_SIZE: int = config("GEOIP_CACHE_SIZE", default=50000)
+    GEOIP_RELOAD_INTERVAL: int = config("GEOIP_RELOAD_INTERVAL", default=60) # in seconds
+    USER_AGENT_CACHE_SIZE: int = config("USER_AGENT_CACHE_SIZE", default=10000)
+    UNIQUE_VISITORS_TTL: int = config("UNIQUE_VISITORS_TTL", default=400) # in days
+    UNIQUE_VISITORS_MAX_RANGE: int = config("UNIQUE_VISITORS_MAX_RANGE", default=366) # in days
+    TOP_K_MAX_MEMBERS: int = config("TOP_K_MAX_MEMBERS", default=1000)
+    ANALYTICS_RETENTION_DAYS: int = config("ANALYTICS_RETENTION_DAYS", default=0) # 0 keeps raw events forever
+    ANALYTICS_PURGE_BATCH_SIZE: int = config("ANALYTICS_PURGE_BATCH_SIZE", default=1000)
+    ANALYTICS_PURGE_PAUSE: float = config("ANALYTICS_PURGE_PAUSE", default=0.1) # in seconds
+    ANALYTICS_ROLLUP_COLLECTION: str = config("ANALYTICS_ROLLUP_COLLECTION", default="analytics_hourly")
+    ANALYTICS_STORAGE: Literal["standard", "timeseries"] = config("ANALYTICS_STORAGE", default="standard")
+    ANALYTICS_TIMESERIES_COLLECTION: str = config("ANALYTICS_TIMESERIES_COLLECTION", default="analytics_ts")
+    ANALYTICS_TIMESERIES_GRANULARITY: Literal["seconds", "minutes", "hours"] = config(
+        "ANALYTICS_TIMESERIES_GRANULARITY", default="minutes"
+    )
 
 class ShortServiceSettings(BaseSettings):
     CACHE_MAP_URLS: bool = config("MAP_URLS", default=True)
     URL_LENGTH: int = config("URL_LENGTH", default=7)
+    REDIRECT_CACHE_SIZE: int = config("REDIRECT_CACHE_SIZE", default=10000)
+    REDIRECT_CACHE_TTL: int = config("REDIRECT_CACHE_TTL", default=60) # in seconds
+    NEGATIVE_CACHE_TTL: int = config("NEGATIVE_CACHE_TTL", default=30) # in seconds
+    LOOKUP_LOCK_TTL: int = config("LOOKUP_LOCK_TTL", default=2000) # in milliseconds
+    REDIRECT_FAST_PATH: bool = config("REDIRECT_FAST_PATH", default=False)
+    SHORT_CODE_STRATEGY: Literal["hash", "counter"] = config("SHORT_CODE_STRATEGY", default="hash")
+    SHORT_CODE_BLOCK_SIZE: int = config("SHORT_CODE_BLOCK_SIZE", default=1000)
+    SHORT_CODE_SECRET: str = config("SHORT_CODE_SECRET", default="scissor") # never change once counter codes exist
+    BULK_SHORTEN_LIMIT: int = config("BULK_SHORTEN_LIMIT", default=1000)
+    DEDUPE_SHORTEN: bool = config("DEDUPE_SHORTEN", default=False)
+    DEDUPE_CACHE_TTL: int = config("DEDUPE_CACHE_TTL", default=86400) # in seconds
+    SHORT_URL_BLOOM_CAPACITY: int = config("SHORT_URL_BLOOM_CAPACITY", default=1_000_000)
+    SHORT_URL_BLOOM_ERROR_RATE: float = config("SHORT_URL_BLOOM_ERROR_RATE", default=0.01)
 
 
 class CryptSettings(BaseSettings):
@@ -47,6 +101,8 @@ class RedisSettings(BaseSettings):
     REDIS_PORT: int = config("REDIS_PORT", default=6379)
     REDIS_USER: str | None = config("REDIS_USER", default=None)
     REDIS_PASS: str | None = config("REDIS_PASS", default=None)
+    REDIS_POOL_SIZE: int = config("REDIS_POOL_SIZE", default=50)
+    REDIS_POOL_TIMEOUT: int = config("REDIS_POOL_TIMEOUT", default=5) # in seconds
 
 
 class MONGOSettings(BaseSettings):
@@ -54,6 +110,9 @@ class MONGOSettings(BaseSettings):
     MONGO_DB: str = config("MONGO_DB", default="DB")
     MONGO_USER: str | None = config("MONGO_USER", default=None)
     MONGO_PASS: str | None = config("MONGO_PASS", default=None)
+    MONGO_POOL_SIZE: int = config("MONGO_POOL_SIZE", default=100)
+    MONGO_MIN_POOL_SIZE: int = config("MONGO_MIN_POOL_SIZE", default=0)
+    MONGO_POOL_TIMEOUT: int = config("MONGO_POOL_TIMEOUT", default=5000) # in milliseconds
 
 
 class FirstUserSettings(BaseSettings):
@@ -2,6 +2,11 @@
 from fastapi import HTTPException, Request, status
 
 
+class BadRequestException(HTTPException):
+    def __init__(self, detail: str = "Bad Request") -> None:
+        super().__init__(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
 class UnauthorizedException(HTTPException):
     def __init__(self, detail: str = "Unauthorized") -> None:
         super().__init__(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
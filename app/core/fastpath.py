@@ -0,0 +1,68 @@
+from datetime import UTC, datetime
+from functools import lru_cache
+from urllib.parse import quote
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.cache.local import redirect_cache
+from app.core.config.settings import settings
+from app.services.data.ingestion import record_activity
+
+# first path segments owned by the FastAPI app itself
+RESERVED_PATHS = {"docs", "redoc", "openapi.json", "static", "api", "test", "favicon.ico"}
+
+
+@lru_cache(maxsize=settings.REDIRECT_CACHE_SIZE)
+def _redirect_headers(original_url: str) -> list[tuple[bytes, bytes]]:
+    # same quoting as starlette's RedirectResponse
+    location = quote(original_url, safe=":/%#?=@[]!$&'()*+,;")
+    return [(b"location", location.encode("latin-1")), (b"content-length", b"0")]
+
+
+class RedirectFastPath:
+    """
+    Pure ASGI middleware that answers `/{short_link}` and `/{short_link}?ref=qr` straight from the
+    in-process redirect cache.
+
+    Anything else, including cache misses, falls through to the wrapped FastAPI app unchanged.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "GET":
+            return await self.app(scope, receive, send)
+        short_link = scope["path"][1:]
+        query = scope["query_string"]
+        if (
+            not short_link
+            or "/" in short_link
+            or short_link[0] == "+"
+            or short_link in RESERVED_PATHS
+            or query not in (b"", b"ref=qr")
+        ):
+            return await self.app(scope, receive, send)
+        original_url = redirect_cache.get(short_link)
+        if original_url is None:
+            return await self.app(scope, receive, send)
+
+        await send({"type": "http.response.start", "status": 307, "headers": _redirect_headers(original_url)})
+        await send({"type": "http.response.body", "body": b""})
+
+        referer = user_agent = ""
+        for name, value in scope["headers"]:
+            if name == b"referer":
+                referer = value.decode("latin-1")
+            elif name == b"user-agent":
+                user_agent = value.decode("latin-1")
+        client = scope.get("client")
+        record_activity(
+            short_link,
+            "qr" if query else None,
+            original_url,
+            user_agent,
+            client[0] if client else "",
+            referer,
+            datetime.now(UTC),
+        )
@@ -1,18 +1,10 @@
 import time
 
+from app.core.config.settings import settings
+from app.core.fastpath import RedirectFastPath
 from app.main import app
 from fastapi import Request
 
-from fastapi.middleware.cors import CORSMiddleware
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
@@ -22,3 +14,8 @@ async def add_process_time_header(request: Request, call_next):
     process_time = time.time() - start_time
     response.headers["X-Process-Time"] = str(process_time)
     return response
+
+
+# added last so it wraps every other middleware
+if settings.REDIRECT_FAST_PATH:
+    app.add_middleware(RedirectFastPath)
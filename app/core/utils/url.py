@@ -8,4 +8,8 @@ LENGTH = settings.URL_LENGTH
 #     return base64.urlsafe_b64encode(hashlib.sha256(url.encode('utf-8')).digest()).decode('utf-8')[:10]
 
 def hash_url(url):
-    return base62.encodebytes(hashlib.sha256(url.encode('utf-8')).digest())[:LENGTH]
\ No newline at end of file
+    return base62.encodebytes(hashlib.sha256(url.encode('utf-8')).digest())[:LENGTH]
+
+
+def url_digest(user_id, url):
+    return hashlib.sha256(f"{user_id}\n{url}".encode('utf-8')).hexdigest()
@@ -1,31 +1,100 @@
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
-from typing import Any, Type
+import threading
+import time
+from typing import Any
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
 from app.core.config.settings import settings
 
 URI = settings.MONGO_URI
 DB = settings.MONGO_DB
 
-# class MongoManager:
-#     def __init__(self, uri: str = URI):
-#         self.db = AsyncIOMotorClient(URI)
 
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Records Mongo connection pool utilisation and checkout wait times.
+
+    Motor runs every operation on an executor thread, checkout start and end are matched per thread.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.open = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.failed_checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _wait(self) -> float:
+        start = getattr(self._local, "start", None)
+        return time.perf_counter() - start if start is not None else 0.0
+
+    def connection_check_out_started(self, event):
+        self._local.start = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait = self._wait()
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.failed_checkouts += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_ready(self, event):
+        pass
 
-#     def __enter__(self) -> AsyncIOMotorDatabase:
-#         return self.db["price_tracker"]
+    def pool_created(self, event):
+        pass
 
+    def pool_ready(self, event):
+        pass
 
-#     def __exit__(self, exc_type, exc_value, traceback):
-#         self.db.close()
+    def pool_cleared(self, event):
+        pass
 
-# def get_db() -> Any:
-#     with MongoManager() as db:
-#         print("Connected to mongo.")
-#         yield db
-#         print("Mongo connection closed.")
+    def pool_closed(self, event):
+        pass
 
-db = AsyncIOMotorClient(URI)[DB]
+    def stats(self) -> dict[str, Any]:
+        return {
+            "max_pool_size": settings.MONGO_POOL_SIZE,
+            "open": self.open,
+            "in_use": self.in_use,
+            "utilisation": self.in_use / settings.MONGO_POOL_SIZE,
+            "checkouts": self.checkouts,
+            "failed_checkouts": self.failed_checkouts,
+            "avg_wait_ms": self.total_wait / self.checkouts * 1000 if self.checkouts else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+        }
 
-# create analytics collection
 
+mongo_pool_metrics = PoolMetrics()
 
+mongo_client = AsyncIOMotorClient(
+    URI,
+    maxPoolSize=settings.MONGO_POOL_SIZE,
+    minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+    waitQueueTimeoutMS=settings.MONGO_POOL_TIMEOUT,
+    event_listeners=[mongo_pool_metrics],
+)
 
+db = mongo_client[DB]
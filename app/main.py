@@ -1,16 +1,35 @@
+import asyncio
 import time
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from app.core.cache.local import listen_for_invalidations
+from app.core.clients import close_clients, redis
 from app.core.config.settings import settings
 from app.core.exceptions import NotFoundException, URLNotFoundException
 from app.routers.url import redirect_route, details_route
 from app.core.dependencies import db as db_conn
 from app.routers import all_router, url
 from app.routers.limiter import limiter
+from app.services.data.ingestion import CLICK_INGESTION_MODE, click_buffer
+from app.services.url import url_handler
+
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    invalidation_listener = asyncio.create_task(listen_for_invalidations(redis))
+    bloom_rebuild = asyncio.create_task(url_handler.rebuild_short_url_filter())
+    if CLICK_INGESTION_MODE in ("buffer", "stream"):
+        click_buffer.start()
+    yield
+    invalidation_listener.cancel()
+    bloom_rebuild.cancel()
+    await click_buffer.stop()
+    await close_clients()
 
 
 app = FastAPI(
@@ -19,6 +38,7 @@ app = FastAPI(
     description="API for Scissors",
     default_response_class=ORJSONResponse,
     debug=settings.DEBUG,
+    lifespan=lifespan,
 )
 app.state.limiter = limiter
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -1,6 +1,6 @@
 from app.routers import analytics, auth, url, user
 
-from app.routers import analytics, auth, url, user, qr
+from app.routers import analytics, auth, url, user, qr, metrics
 from fastapi import APIRouter
 
 
@@ -10,3 +10,4 @@ all_router.include_router(user.router, prefix="/user")
 all_router.include_router(url.router, prefix="/url")
 all_router.include_router(qr.router, prefix="/url")
 all_router.include_router(analytics.router, prefix="/analytics")
+all_router.include_router(metrics.router, prefix="/metrics")
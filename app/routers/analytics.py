@@ -1,14 +1,23 @@
-from fastapi import APIRouter
+from datetime import UTC, date, datetime, timedelta
+
+from fastapi import APIRouter, Query
 from fastapi.responses import ORJSONResponse
 from app.routers.limiter import limiter
 from app.core.dependencies import AnalyticEngine
+from app.services.data.analytics import Interval
 
 router = APIRouter(default_response_class=ORJSONResponse, tags=["analytics"])
 
 
 @router.get("/{short_link}")
-async def get_full_analytics(short_link: str, handler: AnalyticEngine):
-    res = await handler.get_full_analytics_data(short_link)
+async def get_full_analytics(
+    short_link: str,
+    handler: AnalyticEngine,
+    start: datetime | None = Query(None, alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+    interval: Interval | None = None,
+):
+    res = await handler.get_full_analytics_data(short_link, start, end, interval)
     return res
 
 
@@ -18,3 +27,18 @@ async def get_specific_analytics(
 ):
     res = await handler.get_specific_analytics_data(short_link, overview, timeline, location, referrer)
     return res
+
+
+@router.get("/{short_link}/visitors", summary="Approximate unique visitors over a range of days.")
+async def get_unique_visitors(
+    short_link: str, handler: AnalyticEngine, start: date | None = None, end: date | None = None
+):
+    end = end or datetime.now(UTC).date()
+    start = start or end - timedelta(days=29)
+    visitors = await handler.get_unique_visitors(short_link, start, end)
+    return {"short_url": short_link, "start": start, "end": end, "unique_visitors": visitors}
+
+
+@router.get("/{short_link}/top", summary="Live top referrers, countries, cities, devices and OS.")
+async def get_top_k(short_link: str, handler: AnalyticEngine, k: int = Query(10, ge=1, le=100)):
+    return await handler.get_top_k(short_link, k)
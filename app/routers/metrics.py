@@ -0,0 +1,39 @@
+from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
+
+from app.core.cache.bloom import short_url_bloom
+from app.core.cache.local import redirect_cache
+from app.core.cache.singleflight import url_lookups
+from app.core.clients import pool_stats
+from app.services.data.enrich import user_agent_cache_stats
+from app.services.data.geo import geolocator
+from app.services.data.ingestion import CLICK_INGESTION_MODE, click_buffer
+from app.services.data.stream import stream_stats
+
+router = APIRouter(default_response_class=ORJSONResponse, tags=["metrics"])
+
+
+@router.get("/cache")
+async def get_cache_stats():
+    return {
+        "redirect_cache": redirect_cache.stats(),
+        "short_url_bloom": short_url_bloom.stats(),
+        "url_lookups": url_lookups.stats(),
+    }
+
+
+@router.get("/ingestion")
+async def get_ingestion_stats():
+    stats = {
+        "click_buffer": click_buffer.stats(),
+        "geolocation": geolocator.stats(),
+        "user_agents": user_agent_cache_stats(),
+    }
+    if CLICK_INGESTION_MODE == "stream":
+        stats["click_stream"] = await stream_stats()
+    return stats
+
+
+@router.get("/pools")
+async def get_pool_stats():
+    return pool_stats()
@@ -9,10 +9,10 @@ from app.core.responses import direct_response
 from app.core.utils.analytics import extract_from_request
 from app.routers.limiter import limiter
 from app.schemas.qr import QROptions
-from app.schemas.url import ShortenUrl, UpdateUrl, UrlClicks
+from app.schemas.url import BulkShortenResponse, BulkShortenUrl, ShortenUrl, UpdateUrl, UrlClicks
 from app.services.qr import build_qr_code
-from app.services.tasks import track_activity
-from fastapi import APIRouter, Request, status
+from app.services.data.ingestion import record_activity
+from fastapi import APIRouter, Query, Request, status
 from fastapi.responses import ORJSONResponse, RedirectResponse
 from fastapi.routing import APIRoute
 from pydantic import HttpUrl
@@ -49,6 +49,23 @@ async def create_new_short_link(
     return f"{host_url}{short_link}".removeprefix("https://")
 
 
+@router.post("/shorten/bulk", summary="Create many short links in one call.")
+@limiter.limit("5/minute")
+async def create_new_short_links_in_bulk(
+    data: BulkShortenUrl, user: CurrentUser, handler: UrlHandler, request: Request
+):
+    results = await handler.shorten_urls(user.id, [(str(item.url), item.custom_alias) for item in data.urls])
+    host_url = str(request.base_url).removeprefix("http://").removeprefix("https://")
+    for result in results:
+        if result["short_url"]:
+            result["full_short_url"] = f"{host_url}{result['short_url']}"
+    created = sum(result["status"] == "created" for result in results)
+    failed = sum(result["status"] in ("conflict", "error") for result in results)
+    return direct_response(
+        BulkShortenResponse(created=created, failed=failed, results=results)  # type: ignore
+    )
+
+
 @router.post("/quick_shorten")
 async def annonymous_create_short_link(
     url: HttpUrl, handler: UrlHandler, request: Request
@@ -112,6 +129,16 @@ async def get_url_clicks_for_user(
     return data
 
 
+@router.get("/stats/top", summary="Click counts of the user's links, most clicked first.")
+async def get_user_urls_by_clicks(
+    user: CurrentUser,
+    handler: UrlHandler,
+    page: int = Query(1, ge=1),
+    size: int = Query(50, ge=1, le=500),
+):
+    return direct_response(await handler.get_user_urls_by_clicks(user.id, page, size))
+
+
 root_router = APIRouter(default_response_class=ORJSONResponse, tags=["link"])
 
 
@@ -128,7 +155,7 @@ async def forward_to_target_url(
     true_url = await handler.get_original_url(short_link)
  
     referrer, user_agent, ip_address = extract_from_request(request)
-    track_activity.delay(
+    record_activity(
         short_link,
         ref,
         true_url,
@@ -1,9 +1,12 @@
+from typing import Literal
+
 from pydantic import BaseModel, Field, HttpUrl, root_validator, validator
 
 from app.schemas.base import Base
 from app.core.config.settings import settings
 
 BASE_URL = settings.HOST_URL
+BULK_SHORTEN_LIMIT = settings.BULK_SHORTEN_LIMIT
 
 class ShortenUrl(BaseModel):
     url: HttpUrl = Field(..., title="URL to shorten", description="The URL to shorten")
@@ -12,6 +15,26 @@ class ShortenUrl(BaseModel):
     )
 
 
+class BulkShortenUrl(BaseModel):
+    urls: list[ShortenUrl] = Field(
+        ..., min_length=1, max_length=BULK_SHORTEN_LIMIT, title="URLs to shorten", description="The URLs to shorten"
+    )
+
+
+class BulkShortenResult(BaseModel):
+    url: str = Field(..., title="URL", description="The URL that was submitted")
+    short_url: str | None = Field(None, title="Short URL", description="The short URL, if one was created")
+    full_short_url: str | None = Field(None, title="Full short URL", description="The short URL with host")
+    status: Literal["created", "existing", "conflict", "error"]
+    detail: str | None = Field(None, title="Detail", description="Why the URL was not shortened")
+
+
+class BulkShortenResponse(BaseModel):
+    created: int
+    failed: int
+    results: list[BulkShortenResult]
+
+
 class UpdateUrl(BaseModel):
     original_url: HttpUrl | None = Field("", title="Original URL", description="The original URL")
     short_url: str | None = Field("", title="Short URL", description="The short URL")
@@ -42,6 +65,18 @@ class UrlClicks(BaseModel):
     short_urls: list[str]
 
 
+class UrlClickCount(BaseModel):
+    short_url: str = Field(..., title="Short URL", description="The short URL")
+    clicks: int = Field(0, title="Clicks", description="The number of clicks on the short URL")
+
+
+class UrlClicksPage(BaseModel):
+    page: int
+    size: int
+    has_more: bool
+    urls: list[UrlClickCount]
+
+
 class ListUrl(BaseModel):
     urls: list[Url]
 
@@ -5,6 +5,7 @@ from bson import ObjectId
 from fastapi import HTTPException
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from pydantic import BaseModel
+from pymongo.errors import BulkWriteError
 
 from app.local_typing import (
     AgnosticCursor,
@@ -73,13 +74,24 @@ class BaseCRUD(Generic[CreateSchema, ReadSchema, UpdateSchema]):
         await self.on_create()
         return str(result.inserted_id)  # type: ignore
 
-    async def create_many(self, items: list[CreateSchema], **defaults_fields: Any) -> list[str]:
-        items_updated = [item.model_dump() for item in items]
+    async def create_many(self, items: list[CreateSchema | dict], **defaults_fields: Any) -> list[str | None]:
+        """
+        Inserts `items` in a single unordered batch, a failing item does not stop the others.
+
+        Returns the inserted ids in the order of `items`, with None for every item that failed.
+        """
+        if not items:
+            return []
+        items_updated = [item.model_dump() if isinstance(item, BaseModel) else item for item in items]
         if defaults_fields:
             items_updated = [{**item, **defaults_fields} for item in items_updated]
-        result = await self._create_many(items_updated)
+        failed: set[int] = set()
+        try:
+            await self._create_many(items_updated)
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
         await self.on_create()
-        return [str(id) for id in result.inserted_ids]
+        return [None if index in failed else str(item["_id"]) for index, item in enumerate(items_updated)]
 
     async def update(self, id: str, item: UpdateSchema) -> bool:
         if await self.id_exists(
@@ -107,17 +119,10 @@ class BaseCRUD(Generic[CreateSchema, ReadSchema, UpdateSchema]):
         return await self.__create(item_dict)
 
     async def _create_many(self, items_dict: list[dict[str, Any]]) -> DBInsertManyResult:
-        items_updated = list(
-            map(
-                lambda item: (
-                    item.update(
-                        {"created_at": datetime.now(timezone.utc), "updated_at": datetime.now(timezone.utc)}
-                    )
-                ),
-                items_dict,
-            )
-        )
-        return await self._db_conn.get_collection(self._collection).insert_many(items_updated)
+        now = datetime.now(timezone.utc)
+        for item in items_dict:
+            item["created_at"] = item["updated_at"] = now
+        return await self._db_conn.get_collection(self._collection).insert_many(items_dict, ordered=False)
 
     async def _update(self, id: str, item_dict: dict[str, Any]) -> DBUpdateResult:
         item_dict["updated_at"] = datetime.now(timezone.utc)
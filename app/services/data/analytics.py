@@ -1,103 +1,424 @@
-from datetime import UTC, datetime
-from typing import Literal
+import asyncio
+import hashlib
+import secrets
+import time
+from datetime import UTC, date, datetime, timedelta
+from typing import Awaitable, Callable, Literal
 
 import orjson
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
 from redis.asyncio import Redis
-from user_agents import parse
 
+from app.core.cache.redis import redis as shared_redis
 from app.core.config.settings import settings
-from app.core.exceptions import NotFoundException
+from app.core.exceptions import BadRequestException, NotFoundException
 from app.core.logging import log_this
 from app.db.database import db
 from app.schemas.url import UrlAnalyticsResponse
-from app.services.data.pipelines import (
-    gen_countries_and_cities_pipeline,
-    gen_overview_pipeline,
-    gen_referrer_pipeline,
-    gen_timeline_pipeline,
+from app.services.data.enrich import parse_user_agents
+from app.services.data.geo import geolocator
+from app.services.data.layout import EventLayout, analytics_layout
+from app.services.data.pipelines import RAW_PIPELINES, gen_analytics_facet_pipeline, gen_timeline_pipeline
+from app.services.data.refine import merge_analytics, process_location, process_timeline
+from app.services.data.rollups import (
+    ROLLUP_COLLECTION,
+    gen_rollup_updates,
+    hour_of,
+    rollup_location,
+    rollup_overview,
+    rollup_referrers,
+    rollup_timeline,
 )
-from app.services.data.refine import process_location, process_timeline
 
 AGGREGATION_INTERVAL = settings.AGGREGATION_INTERVAL
+AGGREGATION_MODE = settings.ANALYTICS_AGGREGATION_MODE
+STALE_BUDGET = settings.ANALYTICS_STALE_BUDGET * 60
+REFRESH_LOCK_TTL = settings.ANALYTICS_REFRESH_LOCK_TTL
+FULL_RECOMPUTE_INTERVAL = settings.ANALYTICS_FULL_RECOMPUTE_INTERVAL * 60
+INGESTION_LAG = timedelta(seconds=settings.ANALYTICS_INGESTION_LAG)
+CacheState = Literal["fresh", "stale", "expired", "missing"]
+Interval = Literal["hour", "day", "week", "month"]
+# API interval -> `process_timeline` interval
+TIMELINE_INTERVALS = {"hour": "h", "day": "d", "week": "w", "month": "m"}
+# shortest length of each interval, bounds the number of buckets a range can produce
+INTERVAL_LENGTHS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+    "month": timedelta(days=28),
+}
+# range used when only `to` or `interval` is given
+DEFAULT_RANGES = {
+    "hour": timedelta(days=7),
+    "day": timedelta(days=90),
+    "week": timedelta(weeks=52),
+    "month": timedelta(days=730),
+}
+MAX_TIMELINE_BUCKETS = settings.ANALYTICS_MAX_TIMELINE_BUCKETS
+EMPTY_OVERVIEW = {"clicks": 0, "scans": 0, "last_activity": None, "total_engagement": 0}
+UNIQUE_VISITORS_TTL = settings.UNIQUE_VISITORS_TTL * 24 * 60 * 60
+UNIQUE_VISITORS_MAX_RANGE = settings.UNIQUE_VISITORS_MAX_RANGE
+TOP_K_MAX_MEMBERS = settings.TOP_K_MAX_MEMBERS
+# short codes per pipelined round trip when looking up click counts
+CLICKS_LOOKUP_BATCH = 1000
 
-REDIS_HOST = settings.REDIS_HOST
-REDIS_PORT = settings.REDIS_PORT
-REDIS_PASSWORD = settings.REDIS_PASS
-REDIS_USERNAME = settings.REDIS_USER
+# top-k sorted set -> event field
+TOP_K_DIMENSIONS = {
+    "referrers": "referer",
+    "countries": "country",
+    "cities": "city",
+    "devices": "device",
+    "os": "os",
+}
+
+# KEYS are analytics hashes, ARGV holds clicks, scans and last_activity for each key in turn.
+# last_activity only moves forward, ISO timestamps in UTC compare correctly as strings.
+COUNTERS_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    local base = (i - 1) * 3
+    local clicks = tonumber(ARGV[base + 1])
+    local scans = tonumber(ARGV[base + 2])
+    if clicks > 0 then
+        redis.call('HINCRBY', key, 'clicks', clicks)
+    end
+    if scans > 0 then
+        redis.call('HINCRBY', key, 'scans', scans)
+    end
+    redis.call('HINCRBY', key, 'total_activites', clicks + scans)
+    local last_activity = redis.call('HGET', key, 'last_activity')
+    if not last_activity or last_activity < ARGV[base + 3] then
+        redis.call('HSET', key, 'last_activity', ARGV[base + 3])
+    end
+end
+return #KEYS
+"""
+
+# KEYS are top-k sorted sets, ARGV[1] is the member limit, then for each key the number of
+# members followed by member, increment pairs. Full sets follow Space-Saving: a new member replaces
+# the lowest scoring one and inherits its score plus the increment, so memory per link stays bounded,
+# a rising member can always climb into the top and counts only overestimate the long tail.
+TOP_K_SCRIPT = """
+local max_members = tonumber(ARGV[1])
+local pos = 2
+for _, key in ipairs(KEYS) do
+    local members = tonumber(ARGV[pos])
+    pos = pos + 1
+    for _ = 1, members do
+        local member, increment = ARGV[pos], tonumber(ARGV[pos + 1])
+        if redis.call('ZSCORE', key, member) or redis.call('ZCARD', key) < max_members then
+            redis.call('ZINCRBY', key, increment, member)
+        else
+            local lowest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+            redis.call('ZREM', key, lowest[1])
+            redis.call('ZADD', key, tonumber(lowest[2]) + increment, member)
+        end
+        pos = pos + 2
+    end
+end
+return #KEYS
+"""
+
+# KEYS[1] is a lock, ARGV[1] the token it was taken with. Deletes the lock only if it still holds
+# that token, a refresh that outlived its lock must not release the next holder's.
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# keeps background refresh tasks referenced until they finish
+_background_refreshes: set[asyncio.Task] = set()
+
+
+def _as_utc(timestamp: datetime | None) -> datetime | None:
+    # naive query parameters are taken to be UTC
+    if timestamp is None or timestamp.tzinfo is not None:
+        return timestamp
+    return timestamp.replace(tzinfo=UTC)
+
+
+def _split_partial_hours(
+    start: datetime | None, end: datetime | None
+) -> tuple[tuple[datetime | None, datetime | None] | None, list[tuple[datetime | None, datetime | None]]]:
+    """
+    Splits [start, end) into the whole hours rollups can answer and the partial hours at either end,
+    which have to be read from raw events. The whole hours are None if there are none.
+    """
+    hours_start = hours_end = None
+    if start is not None:
+        hours_start = hour_of(start).replace(tzinfo=UTC)
+        if hours_start < start:
+            hours_start += timedelta(hours=1)
+    if end is not None:
+        hours_end = hour_of(end).replace(tzinfo=UTC)
+    if hours_start is not None and hours_end is not None and hours_start >= hours_end:
+        return None, [(start, end)]
+    partial = []
+    if start is not None and start < hours_start:  # type: ignore
+        partial.append((start, hours_start))
+    if end is not None and hours_end < end:  # type: ignore
+        partial.append((hours_end, end))
+    return (hours_start, hours_end), partial
+
+
+def top_k_key(short_url: str, dimension: str) -> str:
+    return f"top:{short_url}:{dimension}"
+
+
+def visitor_key(short_url: str, day: date) -> str:
+    return f"uv:{short_url}:{day:%Y%m%d}"
+
+
+def visitor_fingerprint(ip_address: str, user_agent_string: str) -> str:
+    return hashlib.blake2b(f"{ip_address}|{user_agent_string}".encode(), digest_size=8).hexdigest()
 
 
 class AnalyticsEngine:
-    def __init__(self, db_conn: AsyncIOMotorDatabase):
+    def __init__(self, db_conn: AsyncIOMotorDatabase, redis: Redis = shared_redis):
         self._db_conn = db_conn
-        self.redis = Redis(
-            host=REDIS_HOST,
-            port=REDIS_PORT,
-            username=REDIS_USERNAME,
-            password=REDIS_PASSWORD,
-            decode_responses=True,
-        )
+        self.redis = redis
+        self._update_counters_script = redis.register_script(COUNTERS_SCRIPT)
+        self._update_top_k_script = redis.register_script(TOP_K_SCRIPT)
+        self._release_lock_script = redis.register_script(RELEASE_LOCK_SCRIPT)
 
-    async def _get_overview_stats(self, short_url: str, start_from: datetime | str | None = None):
+    async def _get_rollups(
+        self, short_url: str, start: datetime | None = None, end: datetime | None = None
+    ) -> list[dict]:
+        query: dict = {"short_url": short_url}
+        if start is not None or end is not None:
+            query["hour"] = {}
+            if start is not None:
+                query["hour"]["$gte"] = hour_of(start)
+            if end is not None:
+                query["hour"]["$lt"] = end
         return (
-            await self._db_conn.get_collection("analytics")
-            .aggregate(gen_overview_pipeline(short_url))
+            await self._db_conn.get_collection(ROLLUP_COLLECTION)
+            .find(query, {"_id": 0})
+            .sort("hour", 1)
             .to_list(None)
-        )[0]
+        )
+
+    async def _get_overview_stats(self, short_url: str, rollups: list[dict], start=None, end=None):
+        overview = rollup_overview(rollups)
+        overview.update(
+            await self._range_unique_visitors(short_url, start or (rollups[0]["hour"] if rollups else None), end)
+        )
+        return overview
 
     async def _get_timeline_stats(
-        self, short_url: str, interval: Literal["h", "d"] = "d", start_from: datetime | str | None = None
+        self, short_url: str, rollups: list[dict], interval: Interval = "day", start=None, end=None
     ):
-        data = (
-            await self._db_conn.get_collection("analytics")
-            .aggregate(gen_timeline_pipeline(short_url))
-            .to_list(None)
-        )
-        return process_timeline(data, interval)
+        return process_timeline(rollup_timeline(rollups), TIMELINE_INTERVALS[interval], start, end)
 
-    async def _get_referral_stats(self, short_url: str, start_from: datetime | str | None = None):
-        data = (
-            await self._db_conn.get_collection("analytics")
-            .aggregate(gen_referrer_pipeline(short_url))
-            .to_list(None)
-        )
-        referrers = {}
-        for referrer in data:
-            referrers[referrer["referral"]] = referrer["amount"]
-        if None in referrers or "" in referrers:
-            referrers["direct"] += referrers.pop(None, 0)
-            referrers["direct"] += referrers.pop("", 0)
-        return referrers
-
-    async def _get_location_stats(self, short_url: str, start_from: datetime | str | None = None):
-        data = (
-            await self._db_conn.get_collection("analytics")
-            .aggregate(gen_countries_and_cities_pipeline(short_url))
-            .to_list(None)
+    async def _get_referral_stats(self, short_url: str, rollups: list[dict]):
+        return rollup_referrers(rollups)
+
+    async def _get_location_stats(self, short_url: str, rollups: list[dict]):
+        return rollup_location(rollups)
+
+    async def _range_unique_visitors(
+        self, short_url: str, start: datetime | None, end: datetime | None
+    ) -> dict[str, int | date | None]:
+        """
+        Unique visitors between `start` and `end`, along with the first day actually counted. Daily
+        HyperLogLogs expire and at most UNIQUE_VISITORS_MAX_RANGE of them are unioned, so longer
+        ranges are counted over their most recent days only.
+        """
+        if start is None:
+            return {"unique_visitors": 0, "unique_visitors_since": None}
+        last_day = (end - timedelta(microseconds=1)).date() if end is not None else datetime.now(UTC).date()
+        last_day = min(last_day, datetime.now(UTC).date())
+        window = min(settings.UNIQUE_VISITORS_TTL, UNIQUE_VISITORS_MAX_RANGE)
+        first_day = max(start.date(), last_day - timedelta(days=window - 1))
+        return {
+            "unique_visitors": await self.get_unique_visitors(short_url, first_day, last_day),
+            "unique_visitors_since": first_day,
+        }
+
+    async def _aggregate(self, pipeline: list[dict], layout: EventLayout = analytics_layout) -> list[dict]:
+        return await self._db_conn.get_collection(layout.collection).aggregate(pipeline).to_list(None)
+
+    async def _raw_stats_concurrent(
+        self,
+        short_url: str,
+        layout: EventLayout = analytics_layout,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        interval: Interval = "hour",
+    ) -> dict[str, list]:
+        """
+        Runs the overview, timeline, referrer and location pipelines over raw events concurrently.
+        """
+        pipelines = []
+        for gen_pipeline in RAW_PIPELINES.values():
+            kwargs = {"unit": interval} if gen_pipeline is gen_timeline_pipeline else {}
+            pipelines.append(gen_pipeline(short_url, layout=layout, start=start, end=end, **kwargs))
+        results = await asyncio.gather(*(self._aggregate(pipeline, layout) for pipeline in pipelines))
+        return dict(zip(RAW_PIPELINES, results))
+
+    async def _raw_stats_facet(
+        self,
+        short_url: str,
+        layout: EventLayout = analytics_layout,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        interval: Interval = "hour",
+    ) -> dict[str, list]:
+        """
+        Computes the same four results over raw events in one scan with a `$facet` pipeline.
+        """
+        pipeline = gen_analytics_facet_pipeline(short_url, layout=layout, start=start, end=end, unit=interval)
+        return (await self._aggregate(pipeline, layout))[0]
+
+    async def _stats_from_raw(self, short_url: str, raw: dict[str, list], interval: Interval, start, end):
+        overview = raw["overview"][0] if raw["overview"] else dict(EMPTY_OVERVIEW)
+        first_activity = min((bucket["timestamp"] for bucket in raw["timeline"]), default=None)
+        overview.update(await self._range_unique_visitors(short_url, start or first_activity, end))
+        referrers: dict[str, int] = {}
+        for referrer in raw["referrers"]:
+            name = referrer["referral"] or "direct"
+            referrers[name] = referrers.get(name, 0) + referrer["amount"]
+        country_codes, countries, cities = process_location(raw["location"])
+        location = {"countries": countries, "cities": cities, "country_codes": country_codes}
+        timeline = process_timeline(raw["timeline"], TIMELINE_INTERVALS[interval], start, end)
+        return {"timeline": timeline, "overview": overview, "referrers": referrers, "location": location}
+
+    async def _rollup_stats(
+        self, short_url: str, start: datetime | None, end: datetime | None, interval: Interval
+    ) -> dict:
+        rollups = await self._get_rollups(short_url, start, end)
+        timeline, overview, referrers, location = await asyncio.gather(
+            self._get_timeline_stats(short_url, rollups, interval, start, end),
+            self._get_overview_stats(short_url, rollups, start, end),
+            self._get_referral_stats(short_url, rollups),
+            self._get_location_stats(short_url, rollups),
         )
-        country_codes, countries, cities = process_location(data)
-        return {"countries": countries, "cities": cities, "country_codes": country_codes}
+        return {"timeline": timeline, "overview": overview, "referrers": referrers, "location": location}
+
+    async def compute_analytics(
+        self,
+        short_url: str,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        interval: Interval = "day",
+    ) -> dict:
+        """
+        Builds the dashboard sections for events in [start, end), bucketing the timeline by `interval`.
+
+        Raw modes push the range and bucketing into Mongo. Rollups are hourly, so there the partial
+        hours at either end of the range are read from raw events.
+        """
+        start, end = _as_utc(start), _as_utc(end)
+        if AGGREGATION_MODE == "rollups":
+            hours, partial = _split_partial_hours(start, end)
+            sections = []
+            if hours is not None:
+                sections.append(await self._rollup_stats(short_url, hours[0], hours[1], interval))
+            for partial_start, partial_end in partial:
+                raw = await self._raw_stats_facet(short_url, start=partial_start, end=partial_end, interval=interval)
+                sections.append(await self._stats_from_raw(short_url, raw, interval, partial_start, partial_end))
+            if len(sections) == 1:
+                return sections[0]
+            analytics = sections[0]
+            for section in sections[1:]:
+                analytics = merge_analytics(analytics, section)
+            first_bucket = datetime.fromisoformat(next(iter(analytics["timeline"]["count"])))
+            analytics["overview"].update(await self._range_unique_visitors(short_url, start or first_bucket, end))
+            return analytics
+        if AGGREGATION_MODE == "facet":
+            raw = await self._raw_stats_facet(short_url, start=start, end=end, interval=interval)
+        else:
+            raw = await self._raw_stats_concurrent(short_url, start=start, end=end, interval=interval)
+        return await self._stats_from_raw(short_url, raw, interval, start, end)
 
-    async def _validate_cache_aggr(self, short_url: str) -> bool:
+    async def _cache_state(self, short_url: str) -> CacheState:
+        """
+        `fresh` caches are served as is, `stale` ones are served while a refresh runs in the
+        background, `expired` and `missing` ones have to be recomputed before answering.
+        """
         result = await self.redis.hmget(f"analytics:{short_url}", "last_updated", "last_activity")  # type: ignore
         last_updated, last_activity = result
-        if last_updated and last_activity:
-            last_updated = datetime.fromisoformat(last_updated)
-            last_activity = datetime.fromisoformat(last_activity)
-            if last_activity > last_updated:
-                log_this(f"Cache is stale, last updated: {last_updated}, last activity: {last_activity}")
-                return False
-            if (datetime.now(UTC) - last_updated).seconds > AGGREGATION_INTERVAL * 60:
-                log_this(f"Cache is stale, last updated: {last_updated}, last activity: {last_activity}")
+        if not last_updated:
+            return "missing"
+        last_updated = datetime.fromisoformat(last_updated)
+        age = (datetime.now(UTC) - last_updated).total_seconds()
+        if age > STALE_BUDGET:
+            return "expired"
+        if age > AGGREGATION_INTERVAL * 60:
+            return "stale"
+        if last_activity and datetime.fromisoformat(last_activity) > last_updated:
+            return "stale"
+        return "fresh"
+
+    async def refresh_aggr(self, short_url: str, wait: bool = True) -> bool:
+        """
+        Recomputes the cached dashboard unless another worker already is, in which case this waits
+        for it when `wait` is set. Returns False if the refresh was left to someone else.
+
+        The lock holds a token of its own so only its holder releases it. Waiters that find the
+        cache still unusable afterwards, because the refresh failed or outlived its lock, compete
+        for the lock again rather than all recomputing at once.
+        """
+        lock_key = f"lock:analytics:{short_url}"
+        token = secrets.token_hex(16)
+        while True:
+            if await self.redis.set(lock_key, token, nx=True, px=REFRESH_LOCK_TTL):
+                try:
+                    await self.save_aggr_to_redis(short_url)
+                finally:
+                    await self._release_lock_script(keys=[lock_key], args=[token])
+                return True
+            if not wait:
                 return False
-            return True
-        return False
+            # the lock expires after REFRESH_LOCK_TTL even if its holder dies
+            while await self.redis.exists(lock_key):
+                await asyncio.sleep(0.05)
+            if await self._cache_state(short_url) not in ("missing", "expired"):
+                return True
+
+    async def _refresh_quietly(self, short_url: str) -> None:
+        try:
+            await self.refresh_aggr(short_url, wait=False)
+        except Exception as e:
+            log_this(f"Background analytics refresh for {short_url} failed. {e}", "ERROR")
 
-    async def get_full_analytics_data(self, short_url: str):
-        if not await self._validate_cache_aggr(short_url):
-            log_this("Cache miss, aggregating from analytics data")
-            await self.save_aggr_to_redis(short_url)
-        return await self.get_aggr_from_redis(short_url)
+    def _refresh_in_background(self, short_url: str) -> None:
+        task = asyncio.create_task(self._refresh_quietly(short_url))
+        _background_refreshes.add(task)
+        task.add_done_callback(_background_refreshes.discard)
+
+    async def get_full_analytics_data(
+        self,
+        short_url: str,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        interval: Interval | None = None,
+    ):
+        if start is None and end is None and interval is None:
+            state = await self._cache_state(short_url)
+            if state in ("missing", "expired"):
+                log_this(f"Analytics cache {state} for {short_url}, aggregating from analytics data")
+                await self.refresh_aggr(short_url)
+            elif state == "stale":
+                self._refresh_in_background(short_url)
+            return await self.get_aggr_from_redis(short_url)
+        # ranged requests are not cached, the range already bounds the work
+        interval = interval or "day"
+        now = datetime.now(UTC)
+        end = min(_as_utc(end) or now, now)
+        try:
+            start = _as_utc(start) or end - DEFAULT_RANGES[interval]
+        except OverflowError:
+            raise BadRequestException("`to` is out of range")
+        if start >= end:
+            raise BadRequestException("`from` must be before `to` and in the past")
+        if (end - start) / INTERVAL_LENGTHS[interval] > MAX_TIMELINE_BUCKETS:
+            raise BadRequestException(
+                f"The range spans more than {MAX_TIMELINE_BUCKETS} {interval}s, shorten it or use a longer interval"
+            )
+        return {**await self.compute_analytics(short_url, start, end, interval), "age": 0.0}
 
     async def get_specific_analytics_data(self, short_url: str):
         pass
@@ -110,38 +431,93 @@ class AnalyticsEngine:
             # TODO
             pass
 
-    async def get_url_clicks(self, short_url: list[str]):
-        tasks = [await self.redis.hget(f"analytics:{short}", "clicks") for short in short_url]  # type: ignore
-        return {k: int(v) if v is not None else 0 for k, v in zip(short_url, tasks)}
+    async def get_url_clicks(self, short_url: list[str]) -> dict[str, int]:
+        """
+        Click counts for any number of links, `CLICKS_LOOKUP_BATCH` codes per pipelined round trip.
+        """
+        clicks: list[str | None] = []
+        for i in range(0, len(short_url), CLICKS_LOOKUP_BATCH):
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for short in short_url[i : i + CLICKS_LOOKUP_BATCH]:
+                    pipe.hget(f"analytics:{short}", "clicks")
+                clicks += await pipe.execute()
+        return {k: int(v) if v is not None else 0 for k, v in zip(short_url, clicks)}
 
     async def get_aggr_from_redis(self, short_url: str):
-        result = await self.redis.hgetall(f"analytics:{short_url}")  # type: ignore
+        result = await self.redis.hmget(
+            f"analytics:{short_url}", "last_updated", "timeline", "overview", "referrers", "location"
+        )  # type: ignore
+        last_updated = datetime.fromisoformat(result[0])
         analytics_data = {
-            "timeline": orjson.loads(result["timeline"]),
-            "overview": orjson.loads(result["overview"]),
-            "referrers": orjson.loads(result["referrers"]),
-            "location": orjson.loads(result["location"]),
+            "timeline": orjson.loads(result[1]),
+            "overview": orjson.loads(result[2]),
+            "referrers": orjson.loads(result[3]),
+            "location": orjson.loads(result[4]),
+            "last_updated": last_updated,
+            # seconds since the data was aggregated
+            "age": (datetime.now(UTC) - last_updated).total_seconds(),
         }
         return analytics_data
 
+    async def _merged_base(self, short_url: str, boundary: datetime, now: datetime) -> tuple[dict, datetime]:
+        """
+        Returns the dashboard sections for events before `boundary` and when they were last fully
+        recomputed.
+
+        The cached base is extended with only the events between its `merged_until` and `boundary`.
+        Events stored after their hour was merged, e.g. from a backed up ingestion queue, are missed
+        until the next full recompute, which runs every ANALYTICS_FULL_RECOMPUTE_INTERVAL.
+        """
+        cached_base, merged_until, last_full = await self.redis.hmget(
+            f"analytics:{short_url}", "base", "merged_until", "last_full"
+        )  # type: ignore
+        if (
+            cached_base
+            and merged_until
+            and last_full
+            and (now - datetime.fromisoformat(last_full)).total_seconds() < FULL_RECOMPUTE_INTERVAL
+        ):
+            base, since = orjson.loads(cached_base), datetime.fromisoformat(merged_until)
+            if since < boundary:
+                base = merge_analytics(base, await self.compute_analytics(short_url, since, boundary))
+            return base, datetime.fromisoformat(last_full)
+        return await self.compute_analytics(short_url, end=boundary), now
+
     async def save_aggr_to_redis(self, short_url: str):
-        timeline = await self._get_timeline_stats(short_url)
-        overview = await self._get_overview_stats(short_url)
-        referrers = await self._get_referral_stats(short_url)
-        location = await self._get_location_stats(short_url)
+        """
+        Refreshes the cached dashboard by merging new events into it rather than aggregating every
+        event of the link again.
+
+        Closed hours, up to ANALYTICS_INGESTION_LAG ago, are folded into a cached base. The open hour
+        is aggregated on every refresh and added on top, as hourly rollups only ever cover whole hours.
+        """
+        now = datetime.now(UTC)
+        boundary = hour_of(now - INGESTION_LAG).replace(tzinfo=UTC)
+        base, last_full = await self._merged_base(short_url, boundary, now)
+        analytics = merge_analytics(base, await self.compute_analytics(short_url, start=boundary))
+        # visitor HyperLogLogs can be unioned but not summed, count over the link's whole lifetime
+        first_bucket = datetime.fromisoformat(next(iter(analytics["timeline"]["count"])))
+        analytics["overview"].update(await self._range_unique_visitors(short_url, first_bucket, None))
         await self.redis.hmset(
             f"analytics:{short_url}",
             {
-                "last_updated": datetime.now(UTC).isoformat(),
-                "timeline": orjson.dumps(timeline),
-                "overview": orjson.dumps(overview),
-                "referrers": orjson.dumps(referrers),
-                "location": orjson.dumps(location),
+                "last_updated": now.isoformat(),
+                "timeline": orjson.dumps(analytics["timeline"]),
+                "overview": orjson.dumps(analytics["overview"]),
+                "referrers": orjson.dumps(analytics["referrers"]),
+                "location": orjson.dumps(analytics["location"]),
+                "base": orjson.dumps(base),
+                "merged_until": boundary.isoformat(),
+                "last_full": last_full.isoformat(),
             },
         )  # type: ignore
 
     async def get_url_analytics(self, short_url: str) -> UrlAnalyticsResponse:
-        result = await self._db_conn.get_collection("analytics").find({"short_url": short_url}).to_list(None)
+        result = (
+            await self._db_conn.get_collection(analytics_layout.collection)
+            .find(analytics_layout.match(short_url))
+            .to_list(None)
+        )
         if result:
             return UrlAnalyticsResponse(
                 activities=result,
@@ -154,73 +530,151 @@ class AnalyticsEngine:
         result = await self.get_url_analytics(short_url)
         await self.redis.set(f"analytics:{short_url}", result.json())
 
-    async def _get_location(self, ip_address: str = "105.112.183.107") -> dict[str, str]:
-        # response = requests.get(f"http://ipinfo.io/{ip_address}/json")
-        response = {
-            "ip": "105.112.73.42",
-            "rir": "AFRINIC",
-            "is_bogon": False,
-            "is_mobile": False,
-            "is_crawler": False,
-            "is_datacenter": False,
-            "is_tor": False,
-            "is_proxy": False,
-            "is_vpn": True,
-            "is_abuser": True,
-            "company": {
-                "name": "Airtel Networks Limited",
-                "abuser_score": "0.0008 (Low)",
-                "domain": "www.airtel.com.ng",
-                "type": "isp",
-                "network": "105.112.0.0 - 105.127.255.255",
-                "whois": "https://api.ipapi.is/?whois=105.112.0.0",
-            },
-            "asn": {
-                "asn": 36873,
-                "abuser_score": "0.0012 (Low)",
-                "route": "105.112.73.0/24",
-                "descr": "VNL1-AS, NG",
-                "country": "ng",
-                "active": True,
-                "org": "Airtel Networks Limited",
-                "domain": "www.airtel.com.ng",
-                "type": "isp",
-                "rir": "AFRINIC",
-                "whois": "https://api.ipapi.is/?whois=AS36873",
-            },
-            "location": {
-                "continent": "AF",
-                "country": "USA",
-                "country_code": "US",
-                "state": "Manhanttan",
-                "city": "New York",
-                "latitude": 6.453,
-                "longitude": 3.396,
-                "zip": "102103",
-                "timezone": "Africa/Lagos",
-                "local_time": "2024-03-03T14:58:59+01:00",
-                "local_time_unix": 1709474339,
-                "is_dst": False,
-            },
-            "elapsed_ms": 0.65,
+    def _get_location(self, ip_address: str) -> dict[str, str]:
+        return geolocator.lookup(ip_address)
+
+    def _build_event(self, activity: dict, user_agent: tuple[str, str, str]) -> dict:
+        device, os, browser = user_agent
+        location = self._get_location(activity["ip_address"])
+        return {
+            "short_url": activity["short_url"],
+            "type": activity["type"],
+            "referer": activity["referer"] if activity["referer"] else "direct",
+            "timestamp": activity["timestamp"],
+            "ip_address": activity["ip_address"],
+            "os": os,
+            "device": device,
+            "browser": browser,
+            "original_url": activity["original_url"],
+            **location,
+            **activity.get("extra", {}),
         }
-        # response = requests.get(f"http://ip-api.com/json/{ip_address}")
-        # data = response.json()
-        data = response
-        location_data = data["location"]
-        company_data = data["company"]
-        location = {
-            # "ip": data["ip"],
-            "city": location_data["city"],
-            "continent": location_data["continent"],
-            "region": location_data["state"],
-            "country_code": location_data["country_code"],
-            "country": location_data["country"],
-            "isp": company_data["name"],
-            # "loc": data["loc"],
-            # "org": data["org"],
+
+    async def get_unique_visitors(self, short_url: str, start: date, end: date) -> int:
+        """
+        Approximate number of distinct visitors between `start` and `end` inclusive, the union of
+        the daily HyperLogLogs is counted by Redis without storing it.
+        """
+        days = (end - start).days + 1
+        if days < 1:
+            return 0
+        if days > UNIQUE_VISITORS_MAX_RANGE:
+            raise BadRequestException(f"Unique visitors can be counted over at most {UNIQUE_VISITORS_MAX_RANGE} days")
+        keys = [visitor_key(short_url, start + timedelta(days=offset)) for offset in range(days)]
+        return await self.redis.pfcount(*keys)
+
+    async def get_top_k(self, short_url: str, k: int = 10) -> dict[str, dict[str, int]]:
+        """
+        The `k` highest counts of each top-k dimension, read live from Redis.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for dimension in TOP_K_DIMENSIONS:
+                pipe.zrevrange(top_k_key(short_url, dimension), 0, k - 1, withscores=True)
+            results = await pipe.execute()
+        return {
+            dimension: {member: int(score) for member, score in members}
+            for dimension, members in zip(TOP_K_DIMENSIONS, results)
         }
-        return location
+
+    def _top_k_args(self, events: list[dict]) -> tuple[list[str], list[int | str]]:
+        increments: dict[str, dict[str, int]] = {}
+        for event in events:
+            for dimension, field in TOP_K_DIMENSIONS.items():
+                members = increments.setdefault(top_k_key(event["short_url"], dimension), {})
+                member = event.get(field) or "Unknown"
+                members[member] = members.get(member, 0) + 1
+        args: list[int | str] = [TOP_K_MAX_MEMBERS]
+        for members in increments.values():
+            args.append(len(members))
+            for member, increment in members.items():
+                args += [member, increment]
+        return list(increments), args
+
+    async def _update_counters(self, events: list[dict], activities: list[dict]) -> None:
+        """
+        Applies the click, scan and last activity updates and the top-k increments for every link in
+        `events` atomically, and adds each visitor to the link's HyperLogLog for the day, in a single
+        MULTI/EXEC round trip.
+        """
+        counters: dict[str, list] = {}
+        for event in events:
+            counter = counters.setdefault(event["short_url"], [0, 0, event["timestamp"]])
+            counter[0 if event["type"] == "click" else 1] += 1
+            counter[2] = max(counter[2], event["timestamp"])
+        args: list[int | str] = []
+        for clicks, scans, last_activity in counters.values():
+            args += [clicks, scans, last_activity.isoformat(timespec="microseconds")]
+        visitors: dict[str, set[str]] = {}
+        for activity in activities:
+            timestamp = activity["timestamp"]
+            day = (timestamp.astimezone(UTC) if timestamp.tzinfo else timestamp).date()
+            visitors.setdefault(visitor_key(activity["short_url"], day), set()).add(
+                visitor_fingerprint(activity["ip_address"], activity["user_agent_string"])
+            )
+        async with self.redis.pipeline(transaction=True) as pipe:
+            await self._update_counters_script(
+                keys=[f"analytics:{short_url}" for short_url in counters], args=args, client=pipe
+            )
+            top_k_keys, top_k_args = self._top_k_args(events)
+            await self._update_top_k_script(keys=top_k_keys, args=top_k_args, client=pipe)
+            for key, fingerprints in visitors.items():
+                pipe.pfadd(key, *fingerprints)
+                pipe.expire(key, UNIQUE_VISITORS_TTL)
+            await pipe.execute()
+
+    async def _update_url_clicks(self, events: list[dict]) -> None:
+        # mirrors the Redis click counters on the url documents, so links can be sorted by clicks
+        clicks: dict[str, int] = {}
+        for event in events:
+            if event["type"] == "click":
+                clicks[event["short_url"]] = clicks.get(event["short_url"], 0) + 1
+        if clicks:
+            updates = [UpdateOne({"short_url": short}, {"$inc": {"clicks": count}}) for short, count in clicks.items()]
+            await self._db_conn.get_collection("urls").bulk_write(updates, ordered=False)
+
+    def build_events(self, activities: list[dict]) -> list[dict]:
+        """
+        Enriches activities as built by `make_activity` with user agent and location details.
+        """
+        user_agents = parse_user_agents(activity["user_agent_string"] for activity in activities)
+        return [self._build_event(activity, user_agents[activity["user_agent_string"]]) for activity in activities]
+
+    async def store_events(self, events: list[dict]) -> bool:
+        res = await self._db_conn.get_collection(analytics_layout.collection).insert_many(
+            [analytics_layout.to_document(event) for event in events], ordered=False
+        )
+        return res.acknowledged
+
+    def aggregate_updates(self, events: list[dict], activities: list[dict]) -> list[Callable[[], Awaitable]]:
+        """
+        The updates that add stored events to the Redis counters, top-k sets and visitor
+        HyperLogLogs, the hourly rollups and the url click counts. Each one applies fully or not at
+        all, so a failed one can be retried on its own without counting the others twice.
+        """
+        rollups = self._db_conn.get_collection(ROLLUP_COLLECTION)
+        return [
+            lambda: self._update_counters(events, activities),
+            lambda: rollups.bulk_write(gen_rollup_updates(events), ordered=False),
+            lambda: self._update_url_clicks(events),
+        ]
+
+    async def update_aggregates(self, events: list[dict], activities: list[dict]) -> None:
+        await asyncio.gather(*(update() for update in self.aggregate_updates(events, activities)))
+
+    async def track_activities(self, activities: list[dict]) -> bool:
+        """
+        Records a batch of clicks and scans with one `insert_many` for the raw events, then one Redis
+        script call and concurrent `bulk_write`s of hourly rollup increments and url click counts.
+
+        Aggregates are only updated once the events are stored, so a batch that fails to store can be
+        retried without counting it twice. Each activity is a dict as built by `make_activity`.
+        """
+        if not activities:
+            return True
+        events = self.build_events(activities)
+        stored = await self.store_events(events)
+        await self.update_aggregates(events, activities)
+        return stored
 
     async def track_click(
         self,
@@ -232,34 +686,11 @@ class AnalyticsEngine:
         timestamp: datetime,
         **kwargs,
     ) -> bool:
-
-        user_agent = parse(user_agent_string)
-        device = user_agent.device.family
-        os = user_agent.os.family
-        location = await self._get_location()  # TODO: get location from real ip address
-
         log_this(f"Tracking click for {short_url}, Referer: {referer} Timestamp: {timestamp}")
-        # update cache
-        await self.redis.hincrby(f"analytics:{short_url}", "clicks", 1)  # type: ignore
-        await self.redis.hincrby(f"analytics:{short_url}", "total_activites", 1)  # type: ignore
-        await self.redis.hset(f"analytics:{short_url}", "last_activity", timestamp.isoformat())  # type: ignore
-
-        # update db
-        res = await self._db_conn.get_collection("analytics").insert_one(
-            {
-                "short_url": short_url,
-                "type": "click",
-                "referer": referer if referer else "direct",
-                "timestamp": timestamp,
-                "ip_address": ip_address,
-                "os": os,
-                "device": device,
-                "original_url": original_url,
-                **location,
-                **kwargs,
-            }
+        activity = make_activity(
+            "click", short_url, original_url, user_agent_string, ip_address, referer, timestamp, **kwargs
         )
-        return res.acknowledged
+        return await self.track_activities([activity])
 
     async def track_scan(
         self,
@@ -271,34 +702,33 @@ class AnalyticsEngine:
         timestamp: datetime,
         **kwargs,
     ) -> bool:
-
-        user_agent = parse(user_agent_string)
-        device = user_agent.device.family
-        os = user_agent.os.family
-        location = await self._get_location()  # TODO: get location from real ip address
-
         log_this(f"Tracking scan for {short_url}, Referer: {referer} Timestamp: {timestamp}")
-        # update cache
-        await self.redis.hincrby(f"analytics:{short_url}", "clicks", 1)  # type: ignore
-        await self.redis.hincrby(f"analytics:{short_url}", "total_activites", 1)  # type: ignore
-        await self.redis.hset(f"analytics:{short_url}", "last_activity", timestamp.isoformat())  # type: ignore
-
-        # update db
-        res = await self._db_conn.get_collection("analytics").insert_one(
-            {
-                "short_url": short_url,
-                "type": "scan",
-                "referer": referer if referer else "direct",
-                "timestamp": timestamp,
-                "ip_address": ip_address,
-                "os": os,
-                "device": device,
-                "original_url": original_url,
-                **location,
-                **kwargs,
-            }
+        activity = make_activity(
+            "scan", short_url, original_url, user_agent_string, ip_address, referer, timestamp, **kwargs
         )
-        return res.acknowledged
+        return await self.track_activities([activity])
+
+
+def make_activity(
+    type: Literal["click", "scan"],
+    short_url: str,
+    original_url: str,
+    user_agent_string: str,
+    ip_address: str,
+    referer: str,
+    timestamp: datetime,
+    **kwargs,
+) -> dict:
+    return {
+        "type": type,
+        "short_url": short_url,
+        "original_url": original_url,
+        "user_agent_string": user_agent_string,
+        "ip_address": ip_address,
+        "referer": referer,
+        "timestamp": timestamp,
+        "extra": kwargs,
+    }
 
 
 analytics_processor = AnalyticsEngine(db_conn=db)
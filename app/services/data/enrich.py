@@ -0,0 +1,34 @@
+from functools import lru_cache
+from typing import Any, Iterable
+
+from user_agents import parse
+
+from app.core.config.settings import settings
+
+
+@lru_cache(maxsize=settings.USER_AGENT_CACHE_SIZE)
+def parse_user_agent(user_agent_string: str) -> tuple[str, str, str]:
+    """
+    Parses a user agent string into (device, os, browser) families, memoized per string.
+    """
+    user_agent = parse(user_agent_string)
+    return user_agent.device.family, user_agent.os.family, user_agent.browser.family
+
+
+def parse_user_agents(user_agent_strings: Iterable[str]) -> dict[str, tuple[str, str, str]]:
+    """
+    Parses a batch of user agent strings, each distinct string is looked up only once.
+    """
+    return {user_agent_string: parse_user_agent(user_agent_string) for user_agent_string in set(user_agent_strings)}
+
+
+def user_agent_cache_stats() -> dict[str, Any]:
+    info = parse_user_agent.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": info.hits / lookups if lookups else 0.0,
+    }
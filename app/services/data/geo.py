@@ -0,0 +1,141 @@
+import os
+import time
+from typing import Any
+
+import maxminddb
+
+from app.core.cache.local import TTLCache
+from app.core.config.settings import settings
+from app.core.logging import log_this
+
+UNKNOWN_LOCATION = {
+    "city": "Unknown",
+    "continent": "Unknown",
+    "region": "Unknown",
+    "country_code": "XX",
+    "country": "Unknown",
+    "isp": "Unknown",
+}
+
+
+class _Database:
+    """
+    A memory mapped .mmdb file, reopened when the file on disk changes.
+    """
+
+    def __init__(self, path: str | None, reload_interval: float):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.reader: maxminddb.Reader | None = None
+        self.mtime: float | None = None
+        self.reloads = 0
+        self._checked_at = float("-inf")
+
+    def refresh(self) -> bool:
+        """
+        Opens or reopens the database if it changed, returns True if a new file was loaded.
+        """
+        now = time.monotonic()
+        if not self.path or now - self._checked_at < self.reload_interval:
+            return False
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            if self.reader is None and self.mtime is None:
+                log_this(f"GeoIP database {self.path} not found, locations will be Unknown.", "WARNING")
+                self.mtime = -1.0
+            return False
+        if mtime == self.mtime:
+            return False
+        try:
+            reader = maxminddb.open_database(self.path, maxminddb.MODE_MMAP)
+        except (maxminddb.InvalidDatabaseError, OSError, ValueError) as e:
+            # most likely still being copied, keep the current reader and retry on the next check
+            log_this(f"Could not load GeoIP database {self.path}, keeping the previous one. {e}", "WARNING")
+            return False
+        # the previous reader is left to the garbage collector so in-flight lookups can finish
+        self.reader = reader
+        self.mtime = mtime
+        self.reloads += 1
+        log_this(f"Loaded GeoIP database {self.path}")
+        return True
+
+    def get(self, ip_address: str) -> Any:
+        if self.reader is None:
+            return None
+        return self.reader.get(ip_address)
+
+
+class GeoLocator:
+    """
+    Resolves IP addresses against local MaxMind format databases, no network calls are made.
+
+    The databases are memory mapped once per process, so their pages live in the OS page cache and
+    are shared by every worker. Recent results are kept in a bounded LRU, which is cleared whenever
+    a replaced database file is picked up.
+    """
+
+    def __init__(self, city_db: str | None, asn_db: str | None, cache_size: int, reload_interval: float):
+        self.city_db = _Database(city_db, reload_interval)
+        self.asn_db = _Database(asn_db, reload_interval)
+        self.cache = TTLCache(cache_size, float("inf"))
+        self.lookups = 0
+        self.lookup_time = 0.0
+
+    def _resolve(self, ip_address: str) -> dict[str, str]:
+        try:
+            city = self.city_db.get(ip_address)
+            asn = self.asn_db.get(ip_address)
+        except (ValueError, maxminddb.InvalidDatabaseError):
+            return UNKNOWN_LOCATION
+        if not city and not asn:
+            return UNKNOWN_LOCATION
+        city = city or {}
+        subdivisions = city.get("subdivisions") or [{}]
+        return {
+            "city": city.get("city", {}).get("names", {}).get("en", "Unknown"),
+            "continent": city.get("continent", {}).get("code", "Unknown"),
+            "region": subdivisions[0].get("names", {}).get("en", "Unknown"),
+            "country_code": city.get("country", {}).get("iso_code", "XX"),
+            "country": city.get("country", {}).get("names", {}).get("en", "Unknown"),
+            "isp": (asn or {}).get("autonomous_system_organization", "Unknown"),
+        }
+
+    def lookup(self, ip_address: str) -> dict[str, str]:
+        if self.city_db.refresh() | self.asn_db.refresh():
+            self.cache.clear()
+        location = self.cache.get(ip_address)
+        if location is None:
+            start = time.perf_counter()
+            location = self._resolve(ip_address)
+            self.lookup_time += time.perf_counter() - start
+            self.lookups += 1
+            self.cache.set(ip_address, location)
+        return location
+
+    def stats(self) -> dict[str, Any]:
+        cache = self.cache.stats()
+        return {
+            "city_db": self.city_db.path,
+            "city_db_loaded": self.city_db.reader is not None,
+            "asn_db": self.asn_db.path,
+            "asn_db_loaded": self.asn_db.reader is not None,
+            "reloads": self.city_db.reloads + self.asn_db.reloads,
+            "cache_size": cache["size"],
+            "cache_maxsize": cache["maxsize"],
+            "cache_hits": cache["hits"],
+            "cache_misses": cache["misses"],
+            "cache_hit_rate": cache["hit_rate"],
+            "cache_evictions": cache["evictions"],
+            "db_lookups": self.lookups,
+            "avg_db_lookup_us": self.lookup_time / self.lookups * 1e6 if self.lookups else 0.0,
+        }
+
+
+geolocator = GeoLocator(
+    settings.GEOIP_DB_PATH,
+    settings.GEOIP_ASN_DB_PATH,
+    cache_size=settings.GEOIP_CACHE_SIZE,
+    reload_interval=settings.GEOIP_RELOAD_INTERVAL,
+)
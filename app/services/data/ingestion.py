@@ -0,0 +1,173 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Literal
+
+from app.core.config.settings import settings
+from app.core.logging import log_this
+from app.services.data.analytics import AnalyticsEngine, analytics_processor, make_activity
+from app.services.data.stream import ClickStream, click_stream
+from app.services.tasks import track_activity
+
+CLICK_INGESTION_MODE = settings.CLICK_INGESTION_MODE
+
+
+class ClickBuffer:
+    """
+    In-process buffer that batches redirect activities before writing them.
+
+    The buffer flushes every `batch_size` activities or `flush_interval` milliseconds, whichever
+    comes first. Once `max_size` activities are waiting, new ones are either dropped or spilled
+    to the Celery `track_activity` task depending on `overflow`. A batch that fails to flush goes
+    back to the front of the buffer and is retried up to `flush_retries` times, then it is handled
+    like an overflow.
+
+    The engine is either an `AnalyticsEngine`, storing batches directly, or a `ClickStream`, which
+    appends them to the Redis Stream read by `app.stream_worker`.
+    """
+
+    def __init__(
+        self,
+        engine: AnalyticsEngine | ClickStream,
+        batch_size: int,
+        flush_interval: int,
+        max_size: int,
+        overflow: Literal["drop", "spill"] = "spill",
+        flush_retries: int = 3,
+    ):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval / 1000
+        self.max_size = max_size
+        self.overflow = overflow
+        self.flush_retries = flush_retries
+        self._failed_flushes = 0
+        self._activities: list[dict] = []
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        self.buffered = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed = 0
+        self.retried = 0
+
+    def _overflow(self, activity: dict) -> None:
+        if self.overflow == "spill":
+            self._spill(activity)
+        else:
+            self.dropped += 1
+
+    def add(self, activity: dict) -> None:
+        if len(self._activities) >= self.max_size:
+            self._overflow(activity)
+            return
+        self._activities.append(activity)
+        self.buffered += 1
+        if len(self._activities) >= self.batch_size:
+            self._wakeup.set()
+
+    def _spill(self, activity: dict) -> None:
+        track_activity.delay(
+            activity["short_url"],
+            "qr" if activity["type"] == "scan" else None,
+            activity["original_url"],
+            activity["user_agent_string"],
+            activity["ip_address"],
+            activity["referer"],
+            activity["timestamp"],
+        )
+        self.spilled += 1
+
+    async def flush(self) -> None:
+        while self._activities:
+            batch = self._activities[: self.batch_size]
+            del self._activities[: self.batch_size]
+            try:
+                await self.engine.track_activities(batch)
+                self.flushed += len(batch)
+                self.flushes += 1
+                self._failed_flushes = 0
+            except Exception as e:
+                self.failed += len(batch)
+                self._failed_flushes += 1
+                if self._failed_flushes <= self.flush_retries:
+                    log_this(f"Failed to flush {len(batch)} activities, retrying on the next flush. {e}", "ERROR")
+                    self.retried += len(batch)
+                    self._activities[:0] = batch
+                    return
+                log_this(f"Failed to flush {len(batch)} activities, giving up on them. {e}", "ERROR")
+                self._failed_flushes = 0
+                for activity in batch:
+                    self._overflow(activity)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            # let a flush in progress finish, cancelling it would lose the batch it took
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        while self._activities:
+            # failed batches are retried, then spilled or dropped
+            await self.flush()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pending": len(self._activities),
+            "max_size": self.max_size,
+            "batch_size": self.batch_size,
+            "buffered": self.buffered,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
+
+
+click_buffer = ClickBuffer(
+    click_stream if CLICK_INGESTION_MODE == "stream" else analytics_processor,
+    batch_size=settings.CLICK_BUFFER_BATCH_SIZE,
+    flush_interval=settings.CLICK_BUFFER_FLUSH_INTERVAL,
+    max_size=settings.CLICK_BUFFER_MAX_SIZE,
+    overflow=settings.CLICK_BUFFER_OVERFLOW,
+    flush_retries=settings.CLICK_BUFFER_FLUSH_RETRIES,
+)
+
+
+def record_activity(
+    short_url: str,
+    ref: str | None,
+    original_url: str,
+    user_agent_string: str,
+    ip_address: str,
+    referer: str,
+    timestamp: datetime,
+) -> None:
+    """
+    Hands a redirect over to the configured ingestion pipeline without waiting for it to be stored.
+    """
+    if CLICK_INGESTION_MODE in ("buffer", "stream"):
+        activity_type = "scan" if ref == "qr" else "click"
+        click_buffer.add(
+            make_activity(activity_type, short_url, original_url, user_agent_string, ip_address, referer, timestamp)
+        )
+    else:
+        track_activity.delay(short_url, ref, original_url, user_agent_string, ip_address, referer, timestamp)
@@ -0,0 +1,49 @@
+from typing import Any
+
+from app.core.config.settings import settings
+
+
+class EventLayout:
+    """
+    Describes where analytics events live and how they are shaped.
+
+    The standard layout is a plain collection with one flat document per event. The time series
+    layout keeps `short_url` and `type` in the `meta` field of a MongoDB time series collection and
+    drops fields that can be derived elsewhere, such as `original_url`.
+    """
+
+    def __init__(self, collection: str, meta_field: str | None = None):
+        self.collection = collection
+        self.meta_field = meta_field
+        prefix = f"{meta_field}." if meta_field else ""
+        self.short_url = f"{prefix}short_url"
+        self.type = f"{prefix}type"
+
+    @property
+    def is_timeseries(self) -> bool:
+        return self.meta_field is not None
+
+    def match(self, short_url: str, **filters: Any) -> dict[str, Any]:
+        return {self.short_url: short_url, **filters}
+
+    def to_document(self, event: dict[str, Any]) -> dict[str, Any]:
+        if not self.is_timeseries:
+            return event
+        document = {
+            "timestamp": event["timestamp"],
+            self.meta_field: {"short_url": event["short_url"], "type": event["type"]},
+        }
+        for field in TIMESERIES_FIELDS:
+            if event.get(field) is not None:
+                document[field] = event[field]
+        if "_id" in event:
+            document["_id"] = event["_id"]
+        return document
+
+
+TIMESERIES_FIELDS = ("referer", "ip_address", "os", "device", "browser", "country", "country_code", "city")
+
+STANDARD_LAYOUT = EventLayout("analytics")
+TIMESERIES_LAYOUT = EventLayout(settings.ANALYTICS_TIMESERIES_COLLECTION, meta_field="meta")
+
+analytics_layout = TIMESERIES_LAYOUT if settings.ANALYTICS_STORAGE == "timeseries" else STANDARD_LAYOUT
@@ -1,6 +1,21 @@
-def gen_summary_pipeline(short_url, num_buckets=24, num_top_countries=5, num_top_referrers=5):
+from app.services.data.layout import EventLayout, analytics_layout
+
+
+# events in [start, end), matched on the second half of the (short_url, timestamp) index
+def time_range(start=None, end=None) -> dict:
+    timestamp = {}
+    if start is not None:
+        timestamp["$gte"] = start
+    if end is not None:
+        timestamp["$lt"] = end
+    return {"timestamp": timestamp} if timestamp else {}
+
+
+def gen_summary_pipeline(
+    short_url, num_buckets=24, num_top_countries=5, num_top_referrers=5, layout: EventLayout = analytics_layout
+):
     pipeline = [
-        {"$match": {"short_url": short_url}},
+        {"$match": layout.match(short_url)},
         {
             "$facet": {
                 "total_clicks": [{"$count": "total"}],
@@ -30,14 +45,14 @@ def gen_summary_pipeline(short_url, num_buckets=24, num_top_countries=5, num_top
     return pipeline
 
 
-def gen_overview_pipeline(short_url):
+def gen_overview_pipeline(short_url, layout: EventLayout = analytics_layout, start=None, end=None):
     pipeline = [
-        {"$match": {"short_url": short_url}},
+        {"$match": layout.match(short_url, **time_range(start, end))},
         {
             "$group": {
                 "_id": "overview",
-                "clicks": {"$sum": {"$cond": [{"$eq": ["$type", "click"]}, 1, 0]}},
-                "scans": {"$sum": {"$cond": [{"$eq": ["$type", "scan"]}, 1, 0]}},
+                "clicks": {"$sum": {"$cond": [{"$eq": [f"${layout.type}", "click"]}, 1, 0]}},
+                "scans": {"$sum": {"$cond": [{"$eq": [f"${layout.type}", "scan"]}, 1, 0]}},
                 "last_activity": {"$max": "$timestamp"},
                 "total_engagement": {"$sum": 1},
             }
@@ -49,9 +64,9 @@ def gen_overview_pipeline(short_url):
     return pipeline
 
 
-def gen_referrer_pipeline(short_url: str):
+def gen_referrer_pipeline(short_url: str, layout: EventLayout = analytics_layout, start=None, end=None):
     pipeline = [
-        {"$match": {"short_url": short_url}},
+        {"$match": layout.match(short_url, **time_range(start, end))},
         {"$group": {"_id": "$referer", "count": {"$sum": 1}}},
         {"$sort": {"count": -1}},
         {"$project": {"referral": "$_id", "amount": "$count", "_id": 0}},
@@ -59,11 +74,13 @@ def gen_referrer_pipeline(short_url: str):
     return pipeline
 
 
-def gen_countries_and_cities_pipeline(short_url: str):
+def gen_countries_and_cities_pipeline(
+    short_url: str, layout: EventLayout = analytics_layout, start=None, end=None
+):
     pipeline =[
         
 
-    {"$match": {"short_url": short_url}},
+    {"$match": layout.match(short_url, **time_range(start, end))},
     {"$group": {"_id": {"country": "$country", "city": "$city", "country_code":"$country_code"}, "count": {"$sum": 1}}},
     {"$project": {"_id": 0, "country": "$_id.country", "country_code": "$_id.country_code","city": "$_id.city", "count": 1}}
 
@@ -72,35 +89,76 @@ def gen_countries_and_cities_pipeline(short_url: str):
     return pipeline
 
 
-def gen_timeline_pipeline(short_url: str):
+def gen_timeline_pipeline(
+    short_url: str, layout: EventLayout = analytics_layout, start=None, end=None, unit: str = "hour"
+):
+    timestamp = {"$type": "date", **time_range(start, end).get("timestamp", {})}
     pipeline = [
-        {"$match": {"short_url": short_url, "timestamp": {"$exists": True, "$type": "date"}}},
+        {"$match": layout.match(short_url, timestamp=timestamp)},
         {
             "$group": {
-                "_id": {
-                    "year": {"$year": "$timestamp"},
-                    "month": {"$month": "$timestamp"},
-                    "day": {"$dayOfMonth": "$timestamp"},
-                    "hour": {"$hour": "$timestamp"},
-                    "minute": {"$minute": "$timestamp"},
-                },
+                "_id": {"$dateTrunc": {"date": "$timestamp", "unit": unit, "startOfWeek": "monday"}},
                 "count": {"$sum": 1},
             }
         },
+        {"$project": {"_id": 0, "timestamp": "$_id", "count": 1}},
+        {"$sort": {"timestamp": 1}},
+    ]
+    return pipeline
+
+
+def gen_rollup_backfill_pipeline(since, until, layout: EventLayout = analytics_layout):
+    timestamp = {"$type": "date", "$lt": until}
+    if since is not None:
+        timestamp["$gte"] = since
+    pipeline = [
+        {"$match": {"timestamp": timestamp}},
         {
-            "$project": {
-                "_id": 0,
-                "timestamp": {
-                    "$dateFromParts": {
-                        "year": "$_id.year",
-                        "month": "$_id.month",
-                        "day": "$_id.day",
-                        "hour": "$_id.hour",
-                    }
+            "$group": {
+                "_id": {
+                    "short_url": f"${layout.short_url}",
+                    "hour": {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}},
+                    "type": f"${layout.type}",
+                    "referer": "$referer",
+                    "country": "$country",
+                    "country_code": "$country_code",
+                    "city": "$city",
+                    "device": "$device",
+                    "os": "$os",
+                    "browser": "$browser",
                 },
-                "count": 1,
+                "count": {"$sum": 1},
+                "last_activity": {"$max": "$timestamp"},
             }
         },
-        {"$sort": {"date": 1}},
+        {"$sort": {"_id.short_url": 1, "_id.hour": 1}},
     ]
     return pipeline
+
+
+# facet name -> pipeline generator, every generator starts with the same `$match` stage
+RAW_PIPELINES = {
+    "overview": gen_overview_pipeline,
+    "timeline": gen_timeline_pipeline,
+    "referrers": gen_referrer_pipeline,
+    "location": gen_countries_and_cities_pipeline,
+}
+
+
+def _facet(pipeline: list[dict], outer_match: dict) -> list[dict]:
+    # the link and range are matched once before `$facet`, keep only the stage's other filters
+    match, *stages = pipeline
+    filters = {field: value for field, value in match["$match"].items() if outer_match.get(field) != value}
+    return [{"$match": filters}, *stages] if filters else stages
+
+
+def gen_analytics_facet_pipeline(
+    short_url: str, layout: EventLayout = analytics_layout, start=None, end=None, unit: str = "hour"
+):
+    match = layout.match(short_url, **time_range(start, end))
+    facets = {}
+    for name, gen_pipeline in RAW_PIPELINES.items():
+        kwargs = {"unit": unit} if gen_pipeline is gen_timeline_pipeline else {}
+        facets[name] = _facet(gen_pipeline(short_url, layout=layout, start=start, end=end, **kwargs), match)
+    pipeline = [{"$match": match}, {"$facet": facets}]
+    return pipeline
@@ -1,37 +1,59 @@
-from datetime import UTC, datetime
+from datetime import UTC, datetime, timedelta
 from typing import Literal
 
+import numpy as np
 
-import pandas as pd
+# resample interval -> datetime64 unit, buckets start at the top of the hour, at midnight UTC or on
+# the first of the month. Weeks are handled separately since datetime64 weeks start on Thursday.
+_UNITS = {"h": "h", "d": "D", "m": "M"}
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
 
 
-def process_timeline(data: list, interval: Literal["h","d"] = "h") -> dict:
-    data.append({'timestamp': datetime.now(UTC).isoformat(), 'count': 0})
-    df = pd.DataFrame(data)
-    
-    if not df.empty:
-        df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
-        df.set_index('timestamp', inplace=True)
+def _utc_micros(timestamp: datetime | str) -> int:
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(UTC).replace(tzinfo=None)
+    # integer arithmetic, numpy converts datetime objects one by one and far more slowly
+    return (timestamp - _EPOCH) // _MICROSECOND
 
-        # Resample with hourly frequency, filling missing values with 0
-        df = df.fillna(0).resample(interval).sum()
 
-        df.index = df.index.to_series().apply(lambda x: x.isoformat()) # type: ignore
-    
-    
-    # df["date"] = pd.to_datetime(df["date"], errors="coerce")
+def _bucket_starts(micros: np.ndarray, interval: str) -> tuple[np.ndarray, int]:
+    timestamps = micros.astype("datetime64[us]")
+    if interval == "w":
+        days = timestamps.astype("datetime64[D]").astype(np.int64)
+        # 1970-01-01 was a Thursday, shift back to the Monday of each week like `$dateTrunc`
+        return (days - (days + 3) % 7).astype("datetime64[D]"), 7
+    return timestamps.astype(f"datetime64[{_UNITS[interval]}]"), 1
 
-    # # Set the 'date' column as the index for time series operations
-    # df.set_index("date", inplace=True)
 
-    # # Handle missing data (if needed)
-    # df.fillna(0, inplace=True)  # Replace missing 'count' values with 0
+def process_timeline(
+    data: list,
+    interval: Literal["h", "d", "w", "m"] = "h",
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> dict:
+    """
+    Sums counts into hourly, daily, weekly or monthly UTC buckets, filling gaps with 0.
 
-    # Resample to a desired interval (optional)
-    # df = df.resample('D').sum()  # Resample to daily counts
+    Buckets run from the one holding `start` (or the first count) to the one holding `end`
+    (exclusive, defaults to now). Returns `{"count": {iso_timestamp: count}}`, ISO timestamps carry
+    a `+00:00` offset.
+    """
+    rows = list(data)
+    if start is not None:
+        rows.append({"timestamp": start, "count": 0})
+    rows.append({"timestamp": end - _MICROSECOND if end is not None else datetime.now(UTC), "count": 0})
+    micros = np.array([_utc_micros(row["timestamp"]) for row in rows], dtype=np.int64)
+    timestamps, step = _bucket_starts(micros, interval)
+    counts = np.array([row.get("count") or 0 for row in rows])
 
-    # df['date'] = df['date'].dt.strftime('%Y-%m-%d')
-    return df.to_dict()
+    first = timestamps.min()
+    offsets = (timestamps - first).astype(np.int64) // step
+    totals = np.bincount(offsets, weights=counts).astype(counts.dtype)
+    buckets = np.datetime_as_string((first + np.arange(len(totals)) * step).astype("datetime64[s]"), unit="s")
+    return {"count": {f"{bucket}+00:00": total for bucket, total in zip(buckets, totals.tolist())}}
 
 
 def process_location(data_list: list) -> tuple:
@@ -47,6 +69,53 @@ def process_location(data_list: list) -> tuple:
         # Update the counts for the country and city
         countries[country_name] = countries.get(country_name, 0) + count
         cities[city_name] = cities.get(city_name, 0) + count
-        country_codes[country_code] = country_codes.get(country_name, 0) + count
+        country_codes[country_code] = country_codes.get(country_code, 0) + count
 
-    return country_codes, countries, cities
\ No newline at end of file
+    return country_codes, countries, cities
+
+def _latest(*timestamps: datetime | str | None) -> datetime | None:
+    parsed = []
+    for timestamp in timestamps:
+        if timestamp is None:
+            continue
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        parsed.append(timestamp if timestamp.tzinfo is not None else timestamp.replace(tzinfo=UTC))
+    return max(parsed, default=None)
+
+
+def _add_counts(base: dict[str, int], delta: dict[str, int]) -> dict[str, int]:
+    merged = dict(base)
+    for key, count in delta.items():
+        merged[key] = merged.get(key, 0) + count
+    return merged
+
+
+def _ranked(counts: dict[str, int]) -> dict[str, int]:
+    return dict(sorted(counts.items(), key=lambda item: item[1], reverse=True))
+
+
+def merge_analytics(base: dict, delta: dict) -> dict:
+    """
+    Adds the dashboard sections of a later period onto those of an earlier one.
+
+    Timeline buckets present in both are summed, so `delta` may start inside the last bucket of
+    `base`. Unique visitors cannot be summed and are left to the caller.
+    """
+    timeline = _add_counts(base["timeline"]["count"], delta["timeline"]["count"])
+    overview = {
+        "clicks": base["overview"]["clicks"] + delta["overview"]["clicks"],
+        "scans": base["overview"]["scans"] + delta["overview"]["scans"],
+        "last_activity": _latest(base["overview"]["last_activity"], delta["overview"]["last_activity"]),
+        "total_engagement": base["overview"]["total_engagement"] + delta["overview"]["total_engagement"],
+    }
+    location = {
+        field: _ranked(_add_counts(counts, delta["location"][field])) for field, counts in base["location"].items()
+    }
+    return {
+        # ISO timestamps with the same offset sort chronologically
+        "timeline": {"count": dict(sorted(timeline.items()))},
+        "overview": overview,
+        "referrers": _ranked(_add_counts(base["referrers"], delta["referrers"])),
+        "location": location,
+    }
@@ -0,0 +1,111 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+from redis.asyncio import Redis
+
+from app.core.config.settings import settings
+from app.core.logging import log_this
+from app.services.data.analytics import TOP_K_DIMENSIONS, top_k_key, visitor_key
+from app.services.data.layout import EventLayout, analytics_layout
+from app.services.data.rollups import ROLLUP_COLLECTION, backfill_rollups, hour_of
+
+RETENTION_CHECKPOINT = "analytics_retention"
+
+
+async def _delete_in_batches(collection: AsyncIOMotorCollection, query: dict, batch_size: int, pause: float) -> int:
+    """
+    Deletes matching documents `batch_size` at a time, sleeping `pause` seconds between batches so
+    the deletes never saturate the primary.
+    """
+    deleted = 0
+    while True:
+        ids = [doc["_id"] async for doc in collection.find(query, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            return deleted
+        result = await collection.delete_many({"_id": {"$in": ids}})
+        deleted += result.deleted_count
+        await asyncio.sleep(pause)
+
+
+async def compact_raw_events(
+    db: AsyncIOMotorDatabase,
+    retention_days: int,
+    batch_size: int,
+    pause: float,
+    layout: EventLayout = analytics_layout,
+) -> int:
+    """
+    Drops raw events older than `retention_days` once their hours are covered by rollups.
+
+    Hours since the previous run are first rebuilt from the raw events with `backfill_rollups`, so
+    dashboards for old periods keep working after the events are gone. The cutoff is recorded only
+    after the deletes finish, an interrupted run simply redoes the same range. Only the range that
+    was rebuilt is deleted, events that arrive late for hours before the previous cutoff are kept
+    rather than dropped without ever being rolled up.
+    """
+    cutoff = hour_of(datetime.now(UTC) - timedelta(days=retention_days))
+    checkpoints = db.get_collection("migrations")
+    checkpoint = await checkpoints.find_one({"_id": RETENTION_CHECKPOINT})
+    compacted_until = checkpoint["compacted_until"] if checkpoint else None
+    if compacted_until is not None and compacted_until >= cutoff:
+        return 0
+
+    rebuilt = await backfill_rollups(db, since=compacted_until, until=cutoff, layout=layout)
+    log_this(f"Compacted raw events before {cutoff} into {rebuilt} hourly rollups.")
+    window = {"$lt": cutoff} if compacted_until is None else {"$gte": compacted_until, "$lt": cutoff}
+    deleted = await _delete_in_batches(db.get_collection(layout.collection), {"timestamp": window}, batch_size, pause)
+    await checkpoints.update_one(
+        {"_id": RETENTION_CHECKPOINT}, {"$set": {"compacted_until": cutoff}}, upsert=True
+    )
+    log_this(f"Deleted {deleted} raw events older than {cutoff}.", "DONE")
+    return deleted
+
+
+async def purge_link_analytics(
+    db: AsyncIOMotorDatabase,
+    redis: Redis,
+    short_url: str,
+    deleted_at: datetime,
+    batch_size: int,
+    pause: float,
+    layout: EventLayout = analytics_layout,
+) -> int:
+    """
+    Removes the raw events, rollups and Redis analytics keys a deleted link had by `deleted_at`.
+
+    The purge is queued, so the alias may have been taken again by the time it runs. Anything from
+    the hour of the deletion on is then left alone, it can belong to the new link.
+    """
+    deleted_hour = hour_of(deleted_at)
+    recreated = await db.get_collection("urls").find_one({"short_url": short_url}, {"_id": 1}) is not None
+    rollup_query = {"short_url": short_url, "hour": {"$lt" if recreated else "$lte": deleted_hour}}
+    rollups = db.get_collection(ROLLUP_COLLECTION)
+    days = {rollup["hour"].date() async for rollup in rollups.find(rollup_query, {"hour": 1})}
+    deleted = await _delete_in_batches(
+        db.get_collection(layout.collection),
+        layout.match(short_url, timestamp={"$lt": deleted_at}),
+        batch_size,
+        pause,
+    )
+    await _delete_in_batches(rollups, rollup_query, batch_size, pause)
+    keys = [visitor_key(short_url, day) for day in days if not recreated or day < deleted_hour.date()]
+    if recreated:
+        log_this(f"{short_url} was re-created, keeping its top-k sets.", "WARNING")
+    else:
+        keys += [top_k_key(short_url, dimension) for dimension in TOP_K_DIMENSIONS]
+    for i in range(0, len(keys), batch_size):
+        await redis.unlink(*keys[i : i + batch_size])
+    log_this(f"Purged {deleted} events of deleted link {short_url}.")
+    return deleted
+
+
+async def compact_analytics(db: AsyncIOMotorDatabase) -> int:
+    if not settings.ANALYTICS_RETENTION_DAYS:
+        return 0
+    return await compact_raw_events(
+        db,
+        settings.ANALYTICS_RETENTION_DAYS,
+        batch_size=settings.ANALYTICS_PURGE_BATCH_SIZE,
+        pause=settings.ANALYTICS_PURGE_PAUSE,
+    )
@@ -0,0 +1,176 @@
+from datetime import UTC, datetime
+from typing import Any
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReplaceOne, UpdateOne
+
+from app.core.config.settings import settings
+from app.core.logging import log_this
+from app.services.data.layout import EventLayout, analytics_layout
+from app.services.data.pipelines import gen_rollup_backfill_pipeline
+
+ROLLUP_COLLECTION = settings.ANALYTICS_ROLLUP_COLLECTION
+
+# rollup field -> event field, each rollup field is a map of value -> count
+ROLLUP_DIMENSIONS = {
+    "referrers": "referer",
+    "countries": "country",
+    "country_codes": "country_code",
+    "cities": "city",
+    "devices": "device",
+    "os": "os",
+    "browsers": "browser",
+}
+
+
+def encode_key(value: Any, default: str = "Unknown") -> str:
+    """
+    Makes a value safe to use as a MongoDB field name, `.` and a leading `$` are not allowed.
+    """
+    if value is None or value == "":
+        return default
+    return str(value).replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def decode_key(key: str) -> str:
+    return key.replace("%24", "$").replace("%2E", ".").replace("%25", "%")
+
+
+def _dimension_key(field: str, value: Any) -> str:
+    # events without a referer count as direct visits, like in `AnalyticsEngine._build_event`
+    return encode_key(value, "direct" if field == "referrers" else "Unknown")
+
+
+def hour_of(timestamp: datetime) -> datetime:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(UTC).replace(tzinfo=None)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def gen_rollup_updates(events: list[dict]) -> list[UpdateOne]:
+    """
+    Folds a batch of events into one `$inc` upsert per link and hour.
+    """
+    rollups: dict[tuple[str, datetime], dict[str, Any]] = {}
+    for event in events:
+        rollup = rollups.setdefault(
+            (event["short_url"], hour_of(event["timestamp"])), {"inc": {}, "last_activity": event["timestamp"]}
+        )
+        inc = rollup["inc"]
+        counter = "clicks" if event["type"] == "click" else "scans"
+        inc[counter] = inc.get(counter, 0) + 1
+        inc["total"] = inc.get("total", 0) + 1
+        for field, event_field in ROLLUP_DIMENSIONS.items():
+            path = f"{field}.{_dimension_key(field, event.get(event_field))}"
+            inc[path] = inc.get(path, 0) + 1
+        rollup["last_activity"] = max(rollup["last_activity"], event["timestamp"])
+    return [
+        UpdateOne(
+            {"short_url": short_url, "hour": hour},
+            {"$inc": rollup["inc"], "$max": {"last_activity": rollup["last_activity"]}},
+            upsert=True,
+        )
+        for (short_url, hour), rollup in rollups.items()
+    ]
+
+
+def _merge(rollups: list[dict], field: str) -> dict[str, int]:
+    merged: dict[str, int] = {}
+    for rollup in rollups:
+        for key, count in rollup.get(field, {}).items():
+            key = decode_key(key)
+            merged[key] = merged.get(key, 0) + count
+    return dict(sorted(merged.items(), key=lambda item: item[1], reverse=True))
+
+
+def rollup_overview(rollups: list[dict]) -> dict[str, Any]:
+    return {
+        "clicks": sum(rollup.get("clicks", 0) for rollup in rollups),
+        "scans": sum(rollup.get("scans", 0) for rollup in rollups),
+        "last_activity": max((rollup["last_activity"] for rollup in rollups), default=None),
+        "total_engagement": sum(rollup.get("total", 0) for rollup in rollups),
+    }
+
+
+def rollup_timeline(rollups: list[dict]) -> list[dict]:
+    """
+    Hourly counts in the shape `gen_timeline_pipeline` returns, ready for `process_timeline`.
+    """
+    return [{"timestamp": rollup["hour"], "count": rollup.get("total", 0)} for rollup in rollups]
+
+
+def rollup_referrers(rollups: list[dict]) -> dict[str, int]:
+    return _merge(rollups, "referrers")
+
+
+def rollup_location(rollups: list[dict]) -> dict[str, dict[str, int]]:
+    return {
+        "countries": _merge(rollups, "countries"),
+        "cities": _merge(rollups, "cities"),
+        "country_codes": _merge(rollups, "country_codes"),
+    }
+
+
+def _rollup_document(short_url: str, hour: datetime, groups: list[dict]) -> dict[str, Any]:
+    document: dict[str, Any] = {"short_url": short_url, "hour": hour, "clicks": 0, "scans": 0, "total": 0}
+    document.update({field: {} for field in ROLLUP_DIMENSIONS})
+    for group in groups:
+        count = group["count"]
+        document["clicks" if group["_id"]["type"] == "click" else "scans"] += count
+        document["total"] += count
+        for field, event_field in ROLLUP_DIMENSIONS.items():
+            key = _dimension_key(field, group["_id"].get(event_field))
+            document[field][key] = document[field].get(key, 0) + count
+        if "last_activity" not in document or group["last_activity"] > document["last_activity"]:
+            document["last_activity"] = group["last_activity"]
+    return document
+
+
+def _replace_rollup(key: tuple[str, datetime], groups: list[dict]) -> ReplaceOne:
+    short_url, hour = key
+    return ReplaceOne({"short_url": short_url, "hour": hour}, _rollup_document(short_url, hour, groups), upsert=True)
+
+
+async def backfill_rollups(
+    db: AsyncIOMotorDatabase,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    layout: EventLayout = analytics_layout,
+    batch_size: int = 1000,
+) -> int:
+    """
+    Rebuilds hourly rollups from raw events between `since` and `until`.
+
+    Only closed hours are touched, `until` defaults to the start of the current hour. Each rebuilt
+    hour replaces the stored document, so running the backfill twice gives the same result.
+    """
+    until = hour_of(until or datetime.now(UTC))
+    if since is not None:
+        since = hour_of(since)
+    collection = db.get_collection(ROLLUP_COLLECTION)
+    cursor = db.get_collection(layout.collection).aggregate(
+        gen_rollup_backfill_pipeline(since, until, layout=layout), allowDiskUse=True
+    )
+
+    replaced = 0
+    writes: list[ReplaceOne] = []
+    current: tuple[str, datetime] | None = None
+    groups: list[dict] = []
+    async for group in cursor:
+        key = (group["_id"]["short_url"], group["_id"]["hour"])
+        if current is not None and key != current:
+            writes.append(_replace_rollup(current, groups))
+            groups = []
+        current = key
+        groups.append(group)
+        if len(writes) >= batch_size:
+            await collection.bulk_write(writes, ordered=False)
+            replaced += len(writes)
+            writes = []
+            log_this(f"Backfilled {replaced} hourly rollups.")
+    if current is not None:
+        writes.append(_replace_rollup(current, groups))
+    if writes:
+        await collection.bulk_write(writes, ordered=False)
+        replaced += len(writes)
+    return replaced
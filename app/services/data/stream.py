@@ -0,0 +1,344 @@
+import asyncio
+import os
+import socket
+import time
+from datetime import UTC, datetime
+from typing import Any, Awaitable, Callable
+
+import orjson
+from redis.asyncio import Redis
+from pymongo.errors import BulkWriteError, PyMongoError
+from redis.exceptions import RedisError, ResponseError
+
+from app.core.cache.redis import redis as shared_redis
+from app.core.config.settings import settings
+from app.core.logging import log_this
+from app.services.data.analytics import AnalyticsEngine, analytics_processor, make_activity
+
+STATS_INTERVAL = 10  # in seconds
+RETRY_BACKOFF = 0.1  # in seconds, doubled after every failed round
+RETRY_BACKOFF_MAX = 30  # in seconds
+
+# compact field names, every stream entry is kept in Redis memory until it is trimmed
+_FIELDS = {
+    "short_url": "s",
+    "original_url": "u",
+    "user_agent_string": "a",
+    "ip_address": "i",
+    "referer": "r",
+}
+
+
+def encode_click(activity: dict) -> dict[str, str | int]:
+    entry: dict[str, str | int] = {field: activity[name] or "" for name, field in _FIELDS.items()}
+    entry["t"] = "s" if activity["type"] == "scan" else "c"
+    entry["ts"] = round(activity["timestamp"].timestamp() * 1_000_000)
+    return entry
+
+
+def decode_click(entry: dict[str, str]) -> dict:
+    return make_activity(
+        "scan" if entry["t"] == "s" else "click",
+        entry["s"],
+        entry["u"],
+        entry["a"],
+        entry["i"],
+        entry["r"],
+        datetime.fromtimestamp(int(entry["ts"]) / 1_000_000, UTC),
+    )
+
+
+class ClickStream:
+    """
+    Producer side of the Redis Stream click pipeline.
+
+    `track_activities` has the same signature as `AnalyticsEngine.track_activities`, so a
+    `ClickBuffer` can batch redirects into one pipelined round of `XADD`s instead of storing them.
+    """
+
+    def __init__(self, redis: Redis, key: str, maxlen: int):
+        self.redis = redis
+        self.key = key
+        self.maxlen = maxlen
+        self.added = 0
+
+    async def track_activities(self, activities: list[dict]) -> bool:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for activity in activities:
+                pipe.xadd(self.key, encode_click(activity), maxlen=self.maxlen, approximate=True)
+            await pipe.execute()
+        self.added += len(activities)
+        return True
+
+
+class ClickStreamConsumer:
+    """
+    Consumer group worker that stores clicks from the stream in batches.
+
+    Each round reads up to `batch_size` new entries with `XREADGROUP`, enriches and stores them
+    through `AnalyticsEngine.track_activities` and acknowledges them. Entries left pending for
+    `claim_idle` milliseconds by a crashed consumer are taken over with `XAUTOCLAIM`, so delivery is
+    at least once. Entries delivered `max_deliveries` times without being stored are moved to the
+    `{key}:dead` stream instead of being retried forever.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        engine: AnalyticsEngine,
+        key: str,
+        group: str,
+        consumer: str,
+        batch_size: int,
+        block: int,
+        claim_idle: int,
+        max_deliveries: int,
+    ):
+        self.redis = redis
+        self.engine = engine
+        self.key = key
+        self.group = group
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.block = block
+        self.claim_idle = claim_idle
+        self.max_deliveries = max_deliveries
+        self.dead_key = f"{key}:dead"
+        self._claimed_at = float("-inf")
+        self.batches = 0
+        self.processed = 0
+        self.reclaimed = 0
+        self.malformed = 0
+        self.failed = 0
+        self.dead_lettered = 0
+        self.redis_errors = 0
+        self.retries = 0
+        self.last_batch_size = 0
+        self.process_time = 0.0
+
+    async def ensure_group(self) -> None:
+        try:
+            await self.redis.xgroup_create(self.key, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _dead_letter_entries(self, poison: list[tuple[tuple[str, dict[str, str]], str]]) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for (_, fields), error in poison:
+                pipe.xadd(self.dead_key, {**fields, "error": error})
+            await pipe.execute()
+        self.dead_lettered += len(poison)
+        log_this(f"Moved {len(poison)} clicks from {self.key} to {self.dead_key}. {poison[0][1]}", "WARNING")
+
+    async def _retry(self, ids: list[str], operation: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs `operation` until it succeeds, backing off on Mongo and Redis errors. Those mean an
+        outage rather than bad entries, so the entries stay claimed by this consumer meanwhile.
+        """
+        backoff = 0.0
+        while True:
+            try:
+                return await operation()
+            except BulkWriteError:
+                raise
+            except (PyMongoError, RedisError) as e:
+                self.retries += 1
+                backoff = min(backoff * 2 or RETRY_BACKOFF, RETRY_BACKOFF_MAX)
+                log_this(f"Failed to store {len(ids)} clicks from {self.key}, retry in {backoff:.1f}s. {e}", "ERROR")
+                await asyncio.sleep(backoff)
+                try:
+                    # resets their idle time, so other consumers do not reclaim them while we retry
+                    await self.redis.xclaim(self.key, self.group, self.consumer, 0, ids, justid=True)
+                except RedisError:
+                    pass
+
+    def _build_events(self, decoded: list[tuple[tuple[str, dict], dict]], poison: list) -> tuple[list, list[dict]]:
+        """
+        Enriches the batch, or entry by entry if that fails, returning the entries that could be
+        enriched with their events. The others are added to `poison`.
+        """
+        try:
+            return decoded, self.engine.build_events([activity for _, activity in decoded])
+        except Exception:
+            built, events = [], []
+            for entry, activity in decoded:
+                try:
+                    events += self.engine.build_events([activity])
+                    built.append((entry, activity))
+                except Exception as e:
+                    poison.append((entry, f"enrichment failed: {e}"))
+            return built, events
+
+    async def _process(self, entries: list[tuple[str, dict[str, str]]]) -> None:
+        if not entries:
+            return
+        ids, decoded = [], []
+        # entries that can never be stored, moved to the dead letter stream once the rest is done
+        poison: list[tuple[tuple[str, dict], str]] = []
+        for entry_id, fields in entries:
+            ids.append(entry_id)
+            if not fields:
+                # deleted by trimming while pending
+                continue
+            try:
+                decoded.append(((entry_id, fields), decode_click(fields)))
+            except (KeyError, ValueError) as e:
+                self.malformed += 1
+                poison.append(((entry_id, fields), f"malformed: {e!r}"))
+        start = time.perf_counter()
+        decoded, events = self._build_events(decoded, poison)
+        try:
+            if events:
+                try:
+                    await self._retry(ids, lambda: self.engine.store_events(events))
+                except BulkWriteError as e:
+                    # rejected documents are bad entries, the rest of the batch was stored
+                    rejected = {error["index"] for error in e.details.get("writeErrors", [])}
+                    for index in sorted(rejected):
+                        poison.append((decoded[index][0], "rejected by mongo"))
+                    decoded = [item for index, item in enumerate(decoded) if index not in rejected]
+                    events = [event for index, event in enumerate(events) if index not in rejected]
+            if events:
+                # the events are stored, only the aggregates are retried from here on
+                activities = [activity for _, activity in decoded]
+                for update in self.engine.aggregate_updates(events, activities):
+                    await self._retry(ids, update)
+        except Exception as e:
+            # left pending, XAUTOCLAIM retries them until they are dead lettered
+            self.failed += len(events)
+            log_this(f"Failed to store {len(events)} clicks from {self.key}. {e}", "ERROR")
+            return
+        if poison:
+            await self._dead_letter_entries(poison)
+        await self.redis.xack(self.key, self.group, *ids)
+        self.process_time += time.perf_counter() - start
+        self.batches += 1
+        self.processed += len(events)
+        self.last_batch_size = len(ids)
+
+    async def dead_letter(self) -> None:
+        """
+        Moves pending entries that were delivered `max_deliveries` times to the dead letter stream.
+        """
+        start_id = "-"
+        while True:
+            pending = await self.redis.xpending_range(
+                self.key, self.group, start_id, "+", self.batch_size, idle=self.claim_idle
+            )
+            dead = [entry["message_id"] for entry in pending if entry["times_delivered"] >= self.max_deliveries]
+            if dead:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for entry_id in dead:
+                        for _, fields in await self.redis.xrange(self.key, entry_id, entry_id):
+                            pipe.xadd(self.dead_key, fields)
+                    pipe.xack(self.key, self.group, *dead)
+                    await pipe.execute()
+                self.dead_lettered += len(dead)
+                log_this(f"Moved {len(dead)} clicks from {self.key} to {self.dead_key}.", "WARNING")
+            if len(pending) < self.batch_size:
+                break
+            start_id = f"({pending[-1]['message_id']}"
+
+    async def reclaim(self) -> None:
+        await self.dead_letter()
+        start_id = "0-0"
+        while True:
+            start_id, entries, *_ = await self.redis.xautoclaim(
+                self.key, self.group, self.consumer, self.claim_idle, start_id=start_id, count=self.batch_size
+            )
+            self.reclaimed += len(entries)
+            await self._process(entries)
+            if start_id == "0-0":
+                break
+
+    async def publish_stats(self) -> None:
+        await self.redis.hset(f"{self.key}:consumers", self.consumer, orjson.dumps(self.stats()))  # type: ignore
+
+    async def _round(self) -> None:
+        if time.monotonic() - self._claimed_at > self.claim_idle / 2000:
+            self._claimed_at = time.monotonic()
+            await self.reclaim()
+        response = await self.redis.xreadgroup(
+            self.group, self.consumer, {self.key: ">"}, count=self.batch_size, block=self.block
+        )
+        for _, entries in response:
+            await self._process(entries)
+
+    async def run(self) -> None:
+        log_this(f"Consuming {self.key} as {self.consumer} in group {self.group}")
+        published_at = float("-inf")
+        backoff = 0.0
+        while True:
+            try:
+                if backoff or published_at == float("-inf"):
+                    # also after errors, the stream and group are gone after a Redis restart
+                    await self.ensure_group()
+                await self._round()
+                if time.monotonic() - published_at > STATS_INTERVAL:
+                    published_at = time.monotonic()
+                    await self.publish_stats()
+                backoff = 0.0
+            except RedisError as e:
+                self.redis_errors += 1
+                backoff = min(backoff * 2 or RETRY_BACKOFF, RETRY_BACKOFF_MAX)
+                log_this(f"Redis error while consuming {self.key}, retrying in {backoff:.1f}s. {e}", "ERROR")
+                await asyncio.sleep(backoff)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "processed": self.processed,
+            "last_batch_size": self.last_batch_size,
+            "avg_batch_size": self.processed / self.batches if self.batches else 0.0,
+            "avg_batch_ms": self.process_time / self.batches * 1000 if self.batches else 0.0,
+            "reclaimed": self.reclaimed,
+            "malformed": self.malformed,
+            "failed": self.failed,
+            "dead_lettered": self.dead_lettered,
+            "redis_errors": self.redis_errors,
+            "retries": self.retries,
+            "updated_at": datetime.now(UTC).isoformat(),
+        }
+
+
+async def stream_stats(redis: Redis = shared_redis) -> dict[str, Any]:
+    """
+    Length, pending entries and lag of the click stream, plus the counters each consumer publishes.
+    """
+    key, group_name = settings.CLICK_STREAM_KEY, settings.CLICK_STREAM_GROUP
+    group: dict[str, Any] = {}
+    try:
+        for info in await redis.xinfo_groups(key):
+            if info["name"] == group_name:
+                group = info
+    except ResponseError:
+        pass
+    consumers = await redis.hgetall(f"{key}:consumers")  # type: ignore
+    return {
+        "stream": key,
+        "group": group_name,
+        "length": await redis.xlen(key),
+        "pending": group.get("pending"),
+        # entries not yet delivered to any consumer, reported by Redis 7 and newer
+        "lag": group.get("lag"),
+        "dead_letters": await redis.xlen(f"{key}:dead"),
+        "consumers": {name: orjson.loads(stats) for name, stats in consumers.items()},
+    }
+
+
+click_stream = ClickStream(shared_redis, settings.CLICK_STREAM_KEY, maxlen=settings.CLICK_STREAM_MAXLEN)
+
+
+def build_consumer(consumer: str | None = None, key: str = settings.CLICK_STREAM_KEY) -> ClickStreamConsumer:
+    return ClickStreamConsumer(
+        shared_redis,
+        analytics_processor,
+        key,
+        settings.CLICK_STREAM_GROUP,
+        consumer or f"{socket.gethostname()}-{os.getpid()}",
+        batch_size=settings.CLICK_STREAM_BATCH_SIZE,
+        block=settings.CLICK_STREAM_BLOCK,
+        claim_idle=settings.CLICK_STREAM_CLAIM_IDLE,
+        max_deliveries=settings.CLICK_STREAM_MAX_DELIVERIES,
+    )
@@ -0,0 +1,118 @@
+import asyncio
+from abc import ABC, abstractmethod
+import hashlib
+import random
+import string
+
+import base62
+from redis.asyncio import Redis
+
+from app.core.cache.redis import redis
+from app.core.config.settings import settings
+from app.core.utils.url import hash_url
+
+URL_LENGTH = settings.URL_LENGTH
+
+
+class ShortCodeGenerator(ABC):
+    """
+    Base class for short code strategies.
+
+    `needs_collision_check` tells `UrlHandler` whether generated codes have to be checked against
+    existing ones before use.
+    """
+
+    needs_collision_check: bool = True
+
+    @abstractmethod
+    async def generate(self, original_url: str) -> str:
+        """Returns a short code for `original_url`."""
+
+
+class HashCodeGenerator(ShortCodeGenerator):
+    """
+    Salted SHA-256 of the URL, base62 encoded and truncated to `URL_LENGTH`.
+    """
+
+    needs_collision_check = True
+
+    async def generate(self, original_url: str) -> str:
+        salt = "".join(random.choices(string.ascii_letters + string.digits, k=5))
+        return hash_url(original_url + salt)
+
+
+class CounterCodeGenerator(ShortCodeGenerator):
+    """
+    Allocates sequential ids in blocks leased from a Redis counter and scrambles them with a keyed
+    Feistel permutation, so codes are unique by construction but not guessable from each other.
+
+    The permutation is a bijection on [0, 62**length), changing `secret` after codes were issued
+    would make new codes collide with old ones.
+    """
+
+    needs_collision_check = False
+
+    def __init__(self, redis: Redis, key: str, block_size: int, length: int, secret: str, rounds: int = 4):
+        self.redis = redis
+        self.key = key
+        self.block_size = block_size
+        self.length = length
+        self.domain = 62**length
+        self.half_bits = (self.domain.bit_length() + 1) // 2
+        self.half_mask = (1 << self.half_bits) - 1
+        self.secret = hashlib.blake2b(secret.encode(), digest_size=32).digest()
+        self.rounds = rounds
+        self._next = 0
+        self._end = 0
+        self._lease_lock = asyncio.Lock()
+
+    async def _next_id(self) -> int:
+        async with self._lease_lock:
+            if self._next >= self._end:
+                self._end = await self.redis.incrby(self.key, self.block_size)
+                self._next = self._end - self.block_size
+            id = self._next
+            self._next += 1
+        if id >= self.domain:
+            raise RuntimeError(f"Short code space of length {self.length} is exhausted")
+        return id
+
+    def _round(self, value: int, round: int) -> int:
+        digest = hashlib.blake2b(
+            value.to_bytes(8, "big") + bytes([round]), key=self.secret, digest_size=8
+        ).digest()
+        return int.from_bytes(digest, "big") & self.half_mask
+
+    def _feistel(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.half_mask
+        for round in range(self.rounds):
+            left, right = right, left ^ self._round(right, round)
+        return (left << self.half_bits) | right
+
+    def permute(self, id: int) -> int:
+        # cycle walking keeps the permutation inside [0, domain)
+        value = self._feistel(id)
+        while value >= self.domain:
+            value = self._feistel(value)
+        return value
+
+    def encode(self, value: int) -> str:
+        return base62.encode(value).rjust(self.length, "0")
+
+    async def generate(self, original_url: str) -> str:
+        return self.encode(self.permute(await self._next_id()))
+
+
+def build_code_generator() -> ShortCodeGenerator:
+    if settings.SHORT_CODE_STRATEGY == "counter":
+        return CounterCodeGenerator(
+            redis,
+            "shortcode:counter",
+            block_size=settings.SHORT_CODE_BLOCK_SIZE,
+            length=URL_LENGTH,
+            secret=settings.SHORT_CODE_SECRET,
+        )
+    return HashCodeGenerator()
+
+
+code_generator = build_code_generator()
@@ -1,16 +1,69 @@
 import asyncio
+from datetime import datetime
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Coroutine
 import uvloop
+from celery.signals import worker_process_shutdown, worker_shutdown
+from pymongo import UpdateOne
 from app.celery import celery_app
+from app.core.clients import close_clients, redis
+from app.core.config.settings import settings
 from app.services.data.analytics import analytics_processor
+from app.services.data import retention
 from linkpreview import link_preview
 from app.db.database import db
 
 
+class WorkerLoop:
+    """
+    One long-lived uvloop event loop per worker process, running in a background thread.
+
+    The shared Motor and Redis pools bind to this loop on first use and stay warm between tasks.
+    Tasks submit their coroutines to it, so with the threads pool many of them run concurrently
+    on one loop. A forked child notices the pid change and starts its own loop.
+    """
+
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.thread: threading.Thread | None = None
+        self.pid: int | None = None
+        self._lock = threading.Lock()
+
+    def _running_loop(self) -> asyncio.AbstractEventLoop:
+        if self.loop is None or self.pid != os.getpid():
+            with self._lock:
+                if self.loop is None or self.pid != os.getpid():
+                    self.loop = uvloop.new_event_loop()
+                    self.thread = threading.Thread(target=self.loop.run_forever, name="worker-loop", daemon=True)
+                    self.thread.start()
+                    self.pid = os.getpid()
+        return self.loop
+
+    def run(self, awaitable: Coroutine):
+        return asyncio.run_coroutine_threadsafe(awaitable, self._running_loop()).result()
+
+    def stop(self) -> None:
+        if self.loop is None or self.pid != os.getpid():
+            return
+        asyncio.run_coroutine_threadsafe(close_clients(), self.loop).result(timeout=10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=10)  # type: ignore
+        self.loop = None
+
+
+worker_loop = WorkerLoop()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def stop_worker_loop(**kwargs):
+    worker_loop.stop()
+
 
 def run_async(awaitable: Coroutine):
-    loop = asyncio.get_event_loop()
-    return loop.run_until_complete(awaitable)
+    return worker_loop.run(awaitable)
 
 
 async def update_url(short_url: str, **kwargs):
@@ -39,3 +92,57 @@ def populate_preview(short_url: str, original_url: str):
     if res.acknowledged:
         return f"Preview data populated for {short_url}"
     return "Failed to populate preview data"
+
+
+def _fetch_preview(original_url: str) -> dict | None:
+    try:
+        data = link_preview(original_url)
+    except Exception:
+        return None
+    return {"title": data.title, "description": data.description, "thumbnail": data.image}
+
+
+async def update_urls(updates: list[UpdateOne]):
+    return await db.urls.bulk_write(updates, ordered=False)
+
+
+@celery_app.task
+def populate_previews(links: list[tuple[str, str]]):
+    """
+    Populates preview data for a batch of (short_url, original_url) pairs with one bulk write.
+    """
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        previews = list(executor.map(_fetch_preview, [original_url for _, original_url in links]))
+    updates = [
+        UpdateOne({"short_url": short_url}, {"$set": preview})
+        for (short_url, _), preview in zip(links, previews)
+        if preview is not None
+    ]
+    if updates:
+        run_async(update_urls(updates))
+    return f"Preview data populated for {len(updates)} of {len(links)} urls"
+
+
+@celery_app.task(ignore_result=True)
+def compact_analytics():
+    """
+    Compacts raw events past the retention period into rollups and deletes them.
+    """
+    run_async(retention.compact_analytics(db))
+
+
+@celery_app.task(ignore_result=True, rate_limit="10/m")
+def purge_link_analytics(short_url: str, deleted_at: str):
+    """
+    Removes the analytics of a deleted link, throttled so mass deletions trickle through.
+    """
+    run_async(
+        retention.purge_link_analytics(
+            db,
+            redis,
+            short_url,
+            datetime.fromisoformat(deleted_at),
+            batch_size=settings.ANALYTICS_PURGE_BATCH_SIZE,
+            pause=settings.ANALYTICS_PURGE_PAUSE,
+        )
+    )
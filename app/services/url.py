@@ -1,36 +1,38 @@
-import random
-import string
+import asyncio
+import time
+from datetime import UTC, datetime
 from typing import Any
 
 from bson import ObjectId
 from linkpreview import link_preview
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
 from redis.asyncio import Redis
 
+from app.core.cache.bloom import short_url_bloom
+from app.core.cache.local import publish_invalidation, redirect_cache
+from app.core.cache.redis import redis as shared_redis
+from app.core.cache.singleflight import url_lookups
 from app.core.config.settings import settings
 from app.core.exceptions import ConflictException, ForbiddenException, NotFoundException, URLNotFoundException
 from app.core.logging import log_this
-from app.core.utils.url import hash_url
+from app.core.utils.url import url_digest
 from app.db.database import db
-from app.schemas.url import ListUrl, Url, UrlAnalyticsResponse
+from app.schemas.url import ListUrl, Url, UrlAnalyticsResponse, UrlClicksPage
 from app.services.base_crud import BaseCRUD
-from app.services.tasks import populate_preview
+from app.services.data.layout import analytics_layout
+from app.services.shortcode import code_generator
+from app.services.tasks import populate_preview, populate_previews, purge_link_analytics
 
-REDIS_HOST = settings.REDIS_HOST
-REDIS_PORT = settings.REDIS_PORT
-REDIS_PASSWORD = settings.REDIS_PASS
-REDIS_USERNAME = settings.REDIS_USER
+NEGATIVE_CACHE_TTL = settings.NEGATIVE_CACHE_TTL
+LOOKUP_LOCK_TTL = settings.LOOKUP_LOCK_TTL
+DEDUPE_SHORTEN = settings.DEDUPE_SHORTEN
+DEDUPE_CACHE_TTL = settings.DEDUPE_CACHE_TTL
 
 class UrlHandler(BaseCRUD):
-    def __init__(self, db_conn: AsyncIOMotorDatabase):  # type: ignore
+    def __init__(self, db_conn: AsyncIOMotorDatabase, redis: Redis = shared_redis):  # type: ignore
         super().__init__(db_conn, "urls")
-        self.redis = Redis(
-            host=REDIS_HOST,
-            port=REDIS_PORT,
-            username=REDIS_USERNAME,
-            password=REDIS_PASSWORD,
-            decode_responses=True,
-        )
+        self.redis = redis
 
     async def get_url_details(self, short_url: str) -> Url | None:
         result = await self.get(short_url=short_url)
@@ -38,7 +40,11 @@ class UrlHandler(BaseCRUD):
             return Url(**result)
 
     async def get_url_stats(self, short_url: str) -> UrlAnalyticsResponse:
-        result = await self._db_conn.get_collection("analytics").find({"short_url": short_url}).to_list(None)
+        result = (
+            await self._db_conn.get_collection(analytics_layout.collection)
+            .find(analytics_layout.match(short_url))
+            .to_list(None)
+        )
         if result:
             return UrlAnalyticsResponse(
                 activities=result,
@@ -60,23 +66,91 @@ class UrlHandler(BaseCRUD):
             .to_list(limit)
         ).model_dump()
 
+    async def get_user_urls_by_clicks(self, user_id: str | ObjectId, page: int = 1, size: int = 50) -> UrlClicksPage:
+        """
+        One page of the user's links, most clicked first, read through the (user_id, clicks) index.
+        """
+        urls = (
+            await self._db_conn.get_collection(self._collection)
+            .find({"user_id": user_id}, {"_id": 0, "short_url": 1, "clicks": 1})
+            .sort([("clicks", -1), ("short_url", 1)])
+            .skip((page - 1) * size)
+            .to_list(size + 1)
+        )
+        return UrlClicksPage(page=page, size=size, has_more=len(urls) > size, urls=urls[:size])  # type: ignore
+
     async def _cache_url_mapping(self, short_url: str, original_url: str) -> None:
         await self.redis.set(short_url, original_url)
 
     async def _url_from_cache(self, short_url: str) -> str:
         return await self.redis.get(short_url)
 
+    async def _mark_missing(self, short_url: str) -> None:
+        await self.redis.set(f"missing:{short_url}", 1, ex=NEGATIVE_CACHE_TTL)
+
+    async def _is_known_missing(self, short_url: str) -> bool:
+        if not await short_url_bloom.might_contain(short_url):
+            return True
+        return bool(await self.redis.exists(f"missing:{short_url}"))
+
+    async def _register_short_url(self, *short_urls: str) -> None:
+        await short_url_bloom.add(*short_urls)
+        await self.redis.delete(*[f"missing:{short_url}" for short_url in short_urls])
+
+    async def rebuild_short_url_filter(self) -> bool:
+        cursor = self._db_conn.get_collection(self._collection).find({}, {"short_url": 1, "_id": 0})
+        try:
+            return await short_url_bloom.rebuild(doc["short_url"] async for doc in cursor)
+        except Exception as e:
+            # the filter stays unbuilt and lets every lookup through to the db
+            log_this(f"Failed to rebuild the short url bloom filter. {e}", "ERROR")
+            return False
+
+    async def _url_from_db(self, short_url: str) -> str:
+        log_this(f"Cache miss for {short_url}. Fetching from DB.")
+        doc = await self._db_conn.get_collection(self._collection).find_one({"short_url": short_url})
+        if doc:
+            original_url = doc["original_url"]
+            await self._cache_url_mapping(short_url, original_url)
+            return original_url
+        await self._mark_missing(short_url)
+        raise URLNotFoundException
+
+    async def _load_original_url(self, short_url: str) -> str:
+        """
+        Loads a mapping that missed the cache, letting a single worker query Mongo for it.
+
+        Workers that lose the lock poll the cache until the winner fills it in, and only go
+        to Mongo themselves once the lock would have expired.
+        """
+        lock_key = f"lock:{short_url}"
+        if await self.redis.set(lock_key, 1, nx=True, px=LOOKUP_LOCK_TTL):
+            try:
+                return await self._url_from_db(short_url)
+            finally:
+                await self.redis.delete(lock_key)
+        deadline = time.monotonic() + LOOKUP_LOCK_TTL / 1000
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+            original_url, missing = await self.redis.mget(short_url, f"missing:{short_url}")
+            if original_url is not None:
+                url_lookups.remote_collapsed += 1
+                return original_url
+            if missing is not None:
+                url_lookups.remote_collapsed += 1
+                raise URLNotFoundException
+        return await self._url_from_db(short_url)
+
     async def get_original_url(self, short_url: str):
+        original_url = redirect_cache.get(short_url)
+        if original_url is not None:
+            return original_url
         original_url = await self._url_from_cache(short_url)
         if original_url is None:
-            log_this(f"Cache miss for {short_url}. Fetching from DB.")
-            doc = await self._db_conn.get_collection(self._collection).find_one({"short_url": short_url})
-            if doc:
-                original_url = doc["original_url"]
-                await self._cache_url_mapping(short_url, original_url)
-                return original_url
-            else:
+            if await self._is_known_missing(short_url):
                 raise URLNotFoundException
+            original_url = await url_lookups.do(short_url, lambda: self._load_original_url(short_url))
+        redirect_cache.set(short_url, original_url)
         return original_url
 
     async def _is_owner(self, short_url: str, user_id: str) -> bool:
@@ -89,26 +163,48 @@ class UrlHandler(BaseCRUD):
 
     async def update_url(self, short_url_id: str, user_id: str | ObjectId, **kwargs):
         if await self._is_owner(short_url_id, str(user_id)):
+            if "original_url" in kwargs or "short_url" in kwargs:
+                doc = await self._db_conn.get_collection(self._collection).find_one(
+                    {"short_url": short_url_id}, {"url_digest": 1}
+                )
+                if doc and doc.get("url_digest"):
+                    if "original_url" in kwargs:
+                        kwargs["url_digest"] = url_digest(user_id, str(kwargs["original_url"]))
+                    # a renamed link would otherwise be handed out under its old, now missing code
+                    await self.redis.delete(f"dedupe:{doc['url_digest']}")
             res = await self._db_conn.get_collection(self._collection).update_one(
                 {"short_url": short_url_id}, {"$set": kwargs}
             )
             if res.acknowledged:
                 # TODO: make this a celery task
-                if short := kwargs.get("short_url"):
+                short = kwargs.get("short_url")
+                if short:
                     await self.redis.rename(f"analytics:{short_url_id}", f"analytics:{short}")
                     await self.redis.rename(short_url_id, short)
+                    await self._register_short_url(short)
+                    await self._mark_missing(short_url_id)
+                if "original_url" in kwargs:
+                    await self.redis.delete(short or short_url_id)
+                await publish_invalidation(self.redis, short_url_id, *([short] if short else []))
                 return True
         raise ForbiddenException("You are not the owner of this URL")
 
     async def delete_url(self, short_url: str, user_id: str | ObjectId, **kwargs):
-        if self._is_owner(short_url, str(user_id)):
-            res = await self._db_conn.get_collection(self._collection).delete_one({"short_url": short_url})
-            if res.acknowledged:
-                # TODO: make this a celery task
-                await self.redis.delete(f"analytics:{short_url}")
-                await self.redis.delete(short_url)
-                return True
-        raise ForbiddenException("You are not the owner of this URL")
+        doc = await self._db_conn.get_collection(self._collection).find_one_and_delete(
+            {"short_url": short_url, "user_id": str(user_id)}
+        )
+        if doc is None:
+            if await self.get(short_url=short_url):
+                raise ForbiddenException("You are not the owner of this URL")
+            raise NotFoundException(f"{short_url} not found")
+        if doc.get("url_digest"):
+            await self.redis.delete(f"dedupe:{doc['url_digest']}")
+        await self.redis.delete(f"analytics:{short_url}")
+        await self.redis.delete(short_url)
+        await self._mark_missing(short_url)
+        await publish_invalidation(self.redis, short_url)
+        purge_link_analytics.delay(short_url, datetime.now(UTC).isoformat())
+        return True
 
     async def custom_alias_is_available(self, alias: str) -> bool:
         return not await self._collision_check(alias)
@@ -121,35 +217,214 @@ class UrlHandler(BaseCRUD):
             collides = await self._collision_check(short_url)
             if collides:
                 raise ConflictException(f"Custom alias {short_url} is not available.")
-            await self.create(
-                {"user_id": user_id, "original_url": original_url, "short_url": short_url, **kwargs}
-            )
+            try:
+                await self.create(
+                    {"user_id": user_id, "original_url": original_url, "short_url": short_url, **kwargs}
+                )
+            except DuplicateKeyError:
+                # taken since the check, or missed by a filter that is still being rebuilt
+                raise ConflictException(f"Custom alias {short_url} is not available.")
+            await self._register_short_url(short_url)
             task = populate_preview.delay(short_url, original_url)
         else:
+            if DEDUPE_SHORTEN:
+                digest = url_digest(user_id, original_url)
+                existing = (await self._short_urls_by_digest({digest})).get(digest)
+                if existing:
+                    return existing
+                kwargs["url_digest"] = digest
+            short_url = await self._create_with_generated_code(user_id, original_url, **kwargs)
+            await self._register_short_url(short_url)
+            if DEDUPE_SHORTEN:
+                await self.redis.set(f"dedupe:{digest}", short_url, ex=DEDUPE_CACHE_TTL)
+            task = populate_preview.delay(short_url, original_url)
+        return short_url
+
+    async def _short_urls_by_digest(self, digests: set[str]) -> dict[str, str]:
+        """
+        Looks up short urls already minted for the given `url_digest`s, through the dedupe cache.
+        """
+        if not digests:
+            return {}
+        digests_list = list(digests)
+        cached = await self.redis.mget([f"dedupe:{digest}" for digest in digests_list])
+        found = {digest: short_url for digest, short_url in zip(digests_list, cached) if short_url}
+        missing = [digest for digest in digests_list if digest not in found]
+        if missing:
+            cursor = self._db_conn.get_collection(self._collection).find(
+                {"url_digest": {"$in": missing}}, {"url_digest": 1, "short_url": 1, "_id": 0}
+            )
+            pipe = self.redis.pipeline(transaction=False)
+            async for doc in cursor:
+                found[doc["url_digest"]] = doc["short_url"]
+                pipe.set(f"dedupe:{doc['url_digest']}", doc["short_url"], ex=DEDUPE_CACHE_TTL)
+            await pipe.execute()
+        return found
+
+    async def _create_with_generated_code(self, user_id: str | ObjectId, original_url: str, **kwargs) -> str:
+        # codes that skip the collision check can still clash with a custom alias,
+        # the unique index on short_url catches that
+        while True:
             short_url = await self._generate_short_url(original_url)
-            await self.create(
-                {"user_id": user_id, "original_url": original_url, "short_url": short_url, **kwargs}
+            try:
+                await self.create(
+                    {"user_id": user_id, "original_url": original_url, "short_url": short_url, **kwargs}
+                )
+                return short_url
+            except DuplicateKeyError:
+                log_this(f"Collision detected for {short_url} on insert. Generating new code.", "WARNING")
+
+    async def shorten_urls(
+        self, user_id: str | ObjectId, links: list[tuple[str, str | None]]
+    ) -> list[dict[str, Any]]:
+        """
+        Shortens a batch of (original_url, custom_alias) pairs.
+
+        Collisions for the whole batch are checked with one `$in` query per round and the links are
+        written with one unordered `insert_many`, previews are queued as a single task.
+
+        Returns one result dict per link, in order, with a `status` of created, existing (dedupe
+        mode only), conflict or error.
+        """
+        results: list[dict[str, Any]] = [
+            {"url": original_url, "short_url": None, "status": "created", "detail": None}
+            for original_url, _ in links
+        ]
+        digests: dict[int, str] = {}
+        existing: dict[str, str] = {}
+        if DEDUPE_SHORTEN:
+            digests = {
+                index: url_digest(user_id, original_url)
+                for index, (original_url, custom_alias) in enumerate(links)
+                if not custom_alias
+            }
+            existing = await self._short_urls_by_digest(set(digests.values()))
+        first_with_digest: dict[str, int] = {}
+        repeats: dict[int, int] = {}
+        codes: list[str | None] = [None] * len(links)
+        claimed: set[str] = set()
+        to_check: list[int] = []
+        for index, (original_url, custom_alias) in enumerate(links):
+            if custom_alias:
+                if custom_alias in claimed:
+                    results[index].update(status="conflict", detail=f"Custom alias {custom_alias} is repeated.")
+                    continue
+                codes[index] = custom_alias
+                to_check.append(index)
+            else:
+                digest = digests.get(index)
+                if digest in existing:
+                    results[index].update(short_url=existing[digest], status="existing")
+                    continue
+                if digest in first_with_digest:
+                    repeats[index] = first_with_digest[digest]
+                    continue
+                if digest:
+                    first_with_digest[digest] = index
+                codes[index] = await self._generate_unclaimed_code(original_url, claimed)
+                if code_generator.needs_collision_check:
+                    to_check.append(index)
+            claimed.add(codes[index])  # type: ignore
+
+        while to_check:
+            taken = await self._taken_short_urls([codes[index] for index in to_check])  # type: ignore
+            retry = []
+            for index in to_check:
+                if codes[index] not in taken:
+                    continue
+                original_url, custom_alias = links[index]
+                if custom_alias:
+                    results[index].update(status="conflict", detail=f"Custom alias {custom_alias} is not available.")
+                    codes[index] = None
+                else:
+                    log_this(f"Collision detected for {codes[index]}. Generating new code.")
+                    codes[index] = await self._generate_unclaimed_code(original_url, claimed)
+                    claimed.add(codes[index])  # type: ignore
+                    retry.append(index)
+            to_check = retry
+
+        pending = [index for index, code in enumerate(codes) if code is not None]
+        created = []
+        while pending:
+            ids = await self.create_many(
+                [
+                    {
+                        "user_id": user_id,
+                        "original_url": links[index][0],
+                        "short_url": codes[index],
+                        **({"url_digest": digests[index]} if index in digests else {}),
+                    }
+                    for index in pending
+                ]
             )
-            task = populate_preview.delay(short_url, original_url)
+            failed = []
+            for index, id in zip(pending, ids):
+                if id is None:
+                    failed.append(index)
+                else:
+                    results[index]["short_url"] = codes[index]
+                    created.append(index)
+            if not failed:
+                break
+            # generated codes that skip the collision check can still clash with a custom alias,
+            # those get a new code like in `_create_with_generated_code`
+            taken = await self._taken_short_urls([codes[index] for index in failed])  # type: ignore
+            pending = []
+            for index in failed:
+                original_url, custom_alias = links[index]
+                if codes[index] not in taken:
+                    results[index].update(status="error", detail="The short URL could not be stored.")
+                    continue
+                if custom_alias:
+                    results[index].update(status="conflict", detail=f"Custom alias {custom_alias} is not available.")
+                    continue
+                log_this(f"Collision detected for {codes[index]} on insert. Generating new code.", "WARNING")
+                codes[index] = await self._generate_unclaimed_code(original_url, claimed)
+                claimed.add(codes[index])  # type: ignore
+                pending.append(index)
+        for index, first in repeats.items():
+            if results[first]["status"] == "created":
+                results[index].update(short_url=results[first]["short_url"], status="existing")
+            else:
+                results[index].update(status=results[first]["status"], detail=results[first]["detail"])
+        if created:
+            await self._register_short_url(*[codes[index] for index in created])  # type: ignore
+            if digests:
+                pipe = self.redis.pipeline(transaction=False)
+                for index in created:
+                    if index in digests:
+                        pipe.set(f"dedupe:{digests[index]}", codes[index], ex=DEDUPE_CACHE_TTL)  # type: ignore
+                await pipe.execute()
+            populate_previews.delay([(codes[index], links[index][0]) for index in created])
+        return results
+
+    async def _generate_unclaimed_code(self, original_url: str, claimed: set[str]) -> str:
+        short_url = await code_generator.generate(original_url)
+        while short_url in claimed:
+            short_url = await code_generator.generate(original_url)
         return short_url
 
+    async def _taken_short_urls(self, short_urls: list[str]) -> set[str]:
+        cursor = self._db_conn.get_collection(self._collection).find(
+            {"short_url": {"$in": short_urls}}, {"short_url": 1, "_id": 0}
+        )
+        return {doc["short_url"] async for doc in cursor}
+
     async def _scout_url_info(self, original_url: str) -> dict[str, Any]:
         preview = link_preview(original_url)
         return {"title": preview.title, "description": preview.description, "thumbnail": preview.image}
 
     async def _generate_short_url(self, original_url: str) -> str:
-        salt = "".join(random.choices(string.ascii_letters + string.digits, k=5))
-        short_url = hash_url(original_url + salt)
-        collides = await self._collision_check(short_url)
-        if collides:
-            log_this(f"Collision detected for {short_url}. Generating new hash.")
-            short_url = await self._generate_short_url(original_url)
-            return short_url
-        else:
-            return short_url
+        short_url = await code_generator.generate(original_url)
+        while code_generator.needs_collision_check and await self._collision_check(short_url):
+            log_this(f"Collision detected for {short_url}. Generating new code.")
+            short_url = await code_generator.generate(original_url)
+        return short_url
 
     async def _collision_check(self, short_url: str) -> bool:
         log_this(f"Checking for collision with {short_url}")
+        if not await short_url_bloom.might_contain(short_url):
+            return False
         return (
             await self._db_conn.get_collection(self._collection).find_one({"short_url": short_url})
             is not None
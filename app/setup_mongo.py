@@ -3,9 +3,21 @@ from datetime import datetime
 import sys
 
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import CollectionInvalid
 
 from app.core.config.settings import settings
 from app.core.logging import log_this
+from app.services.data.analytics import AnalyticsEngine
+from app.services.data.layout import STANDARD_LAYOUT, TIMESERIES_LAYOUT
+from app.services.data.pipelines import (
+    gen_countries_and_cities_pipeline,
+    gen_overview_pipeline,
+    gen_referrer_pipeline,
+    gen_summary_pipeline,
+    gen_timeline_pipeline,
+)
+from app.services.data.rollups import ROLLUP_COLLECTION, backfill_rollups
 
 
 # conncect to mongo
@@ -25,10 +37,18 @@ async def setup_mongo():
         db = connect_to_mongo()
         log_this("Creating collections and indexing.")
         await db["urls"].create_index("short_url", unique=True)
+        await db["urls"].create_index("url_digest", sparse=True)
+        await db["urls"].create_index([("user_id", 1), ("clicks", -1), ("short_url", 1)])
 
         await db["users"].create_index("email", unique=True)
 
         await db["analytics"].create_index(["short_url", "timestamp"])
+        await db[ROLLUP_COLLECTION].create_index([("short_url", 1), ("hour", 1)], unique=True)
+        if settings.ANALYTICS_RETENTION_DAYS:
+            # lets compaction find expired events without a collection scan
+            await db["analytics"].create_index("timestamp")
+        if settings.ANALYTICS_STORAGE == "timeseries":
+            await create_timeseries_collection(db)
         log_this("Created indexes.")
     except Exception as e:
         log_this(f"Failed to create indexes. {e}")
@@ -59,6 +79,170 @@ async def reconvert_all():
     except Exception as e:
         log_this(f"Failed to convert all string time to datetime in analytics collection. {e}")
         sys.exit(1)
+
+
+# time series layout for analytics events, see app/services/data/layout.py
+async def create_timeseries_collection(db):
+    try:
+        await db.create_collection(
+            TIMESERIES_LAYOUT.collection,
+            timeseries={
+                "timeField": "timestamp",
+                "metaField": TIMESERIES_LAYOUT.meta_field,
+                "granularity": settings.ANALYTICS_TIMESERIES_GRANULARITY,
+            },
+        )
+        log_this(f"Created time series collection {TIMESERIES_LAYOUT.collection}.")
+    except CollectionInvalid:
+        pass
+    await db[TIMESERIES_LAYOUT.collection].create_index([(TIMESERIES_LAYOUT.short_url, 1), ("timestamp", 1)])
+
+
+def _id_range(after, until) -> dict:
+    return {"$lte": until} if after is None else {"$gt": after, "$lte": until}
+
+
+async def migrate_analytics_to_timeseries(batch_size: int = 5000):
+    """
+    Copies events from the standard collection into the time series collection in `_id` order.
+
+    Only events up to the last `_id` in the source when the first run started are copied. Progress
+    is checkpointed in the `migrations` collection after every batch, so an interrupted run picks up
+    where it stopped. Time series collections do not enforce unique `_id`s, so a resumed run first
+    removes the one batch that may have been copied after the last checkpoint (deleting by `_id`
+    needs MongoDB 7.0 or newer, fresh runs work on 6.0). A completed migration is never run again.
+    """
+    db = connect_to_mongo()
+    await create_timeseries_collection(db)
+    source = db[STANDARD_LAYOUT.collection]
+    target = db[TIMESERIES_LAYOUT.collection]
+    migrations = db["migrations"]
+    name = f"{STANDARD_LAYOUT.collection}->{TIMESERIES_LAYOUT.collection}"
+
+    checkpoint = await migrations.find_one({"_id": name}) or {}
+    if checkpoint.get("completed_at"):
+        log_this(f"{name} already completed at {checkpoint['completed_at']}.", "DONE")
+        return
+    last_id, until_id, copied = checkpoint.get("last_id"), checkpoint.get("until_id"), checkpoint.get("copied", 0)
+    if until_id is None:
+        newest = await source.find({}, {"_id": 1}).sort("_id", -1).limit(1).to_list(None)
+        if not newest:
+            log_this(f"No events to migrate for {name}.", "DONE")
+            return
+        until_id = newest[0]["_id"]
+        await migrations.update_one({"_id": name}, {"$set": {"until_id": until_id}}, upsert=True)
+    if checkpoint:
+        # the batch after the checkpoint may have been inserted before the run stopped
+        unconfirmed = (
+            await source.find({"_id": _id_range(last_id, until_id)}, {"_id": 1})
+            .sort("_id", 1)
+            .skip(batch_size - 1)
+            .limit(1)
+            .to_list(None)
+        )
+        await target.delete_many({"_id": _id_range(last_id, unconfirmed[0]["_id"] if unconfirmed else until_id)})
+        log_this(f"Resuming {name} after {last_id}, {copied} events already copied.")
+
+    while True:
+        query = {"_id": _id_range(last_id, until_id)}
+        batch = await source.find(query).sort("_id", 1).limit(batch_size).to_list(None)
+        if not batch:
+            break
+        documents = [
+            TIMESERIES_LAYOUT.to_document(doc) for doc in batch if isinstance(doc.get("timestamp"), datetime)
+        ]
+        if documents:
+            await target.insert_many(documents, ordered=False)
+        last_id = batch[-1]["_id"]
+        copied += len(documents)
+        await migrations.update_one(
+            {"_id": name},
+            {"$set": {"last_id": last_id, "copied": copied, "updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        log_this(f"Copied {copied} events to {TIMESERIES_LAYOUT.collection}.")
+
+    await migrations.update_one({"_id": name}, {"$set": {"completed_at": datetime.utcnow()}})
+    log_this(f"Migrated {copied} events to {TIMESERIES_LAYOUT.collection}.", "DONE")
+
+
+def _unordered(documents: list[dict]) -> list[str]:
+    return sorted(repr(sorted(document.items())) for document in documents)
+
+
+async def verify_analytics_layouts(short_urls: list[str]) -> bool:
+    """
+    Runs every analytics pipeline against both layouts and reports any short url whose results differ.
+    """
+    db = connect_to_mongo()
+    pipelines = {
+        "summary": gen_summary_pipeline,
+        "overview": gen_overview_pipeline,
+        "referrer": gen_referrer_pipeline,
+        "location": gen_countries_and_cities_pipeline,
+        "timeline": gen_timeline_pipeline,
+    }
+    matches = True
+    for short_url in short_urls:
+        for name, gen_pipeline in pipelines.items():
+            results = []
+            for layout in (STANDARD_LAYOUT, TIMESERIES_LAYOUT):
+                results.append(
+                    await db[layout.collection].aggregate(gen_pipeline(short_url, layout=layout)).to_list(None)
+                )
+            # groups come back in no particular order, and ties in sorted pipelines in any order
+            if _unordered(results[0]) != _unordered(results[1]):
+                matches = False
+                log_this(f"{name} pipeline differs between layouts for {short_url}.", "ERROR")
+    if matches:
+        log_this(f"Pipelines match on both layouts for {len(short_urls)} short urls.", "DONE")
+    return matches
+
+
+async def backfill_hourly_rollups(since: str | None = None, until: str | None = None):
+    try:
+        db = connect_to_mongo()
+        log_this("Backfilling hourly analytics rollups.")
+        count = await backfill_rollups(
+            db,
+            since=datetime.fromisoformat(since) if since else None,
+            until=datetime.fromisoformat(until) if until else None,
+        )
+        log_this(f"Backfilled {count} hourly rollups.", "DONE")
+    except Exception as e:
+        log_this(f"Failed to backfill hourly rollups. {e}", "ERROR")
+        sys.exit(1)
+
+
+async def sync_url_clicks(batch_size: int = 1000):
+    """
+    Copies the Redis click counters onto the url documents, for links created before clicks were
+    counted there. Clicks recorded while a batch is copied can be lost, run it during a quiet period.
+    """
+    try:
+        db = connect_to_mongo()
+        urls = db["urls"]
+        engine = AnalyticsEngine(db)
+        synced, last_id = 0, None
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            batch = await urls.find(query, {"short_url": 1}).sort("_id", 1).limit(batch_size).to_list(None)
+            if not batch:
+                break
+            clicks = await engine.get_url_clicks([doc["short_url"] for doc in batch])
+            await urls.bulk_write(
+                [UpdateOne({"_id": doc["_id"]}, {"$set": {"clicks": clicks[doc["short_url"]]}}) for doc in batch],
+                ordered=False,
+            )
+            last_id = batch[-1]["_id"]
+            synced += len(batch)
+            log_this(f"Synced click counts of {synced} urls.")
+        log_this(f"Synced click counts of {synced} urls.", "DONE")
+    except Exception as e:
+        log_this(f"Failed to sync url click counts. {e}", "ERROR")
+        sys.exit(1)
+
+
 # async def mongo_status():
 #     try:
 #         await db.command("ping")
@@ -68,5 +252,14 @@ async def reconvert_all():
 #         sys.exit(1)
 
 if __name__ == "__main__":
-    asyncio.run(setup_mongo())
-    log_this("SETUP COMPLETE.", "DONE")
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate-timeseries":
+        asyncio.run(migrate_analytics_to_timeseries())
+    elif len(sys.argv) > 1 and sys.argv[1] == "backfill-rollups":
+        asyncio.run(backfill_hourly_rollups(*sys.argv[2:4]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "sync-url-clicks":
+        asyncio.run(sync_url_clicks())
+    elif len(sys.argv) > 1 and sys.argv[1] == "verify-timeseries":
+        asyncio.run(verify_analytics_layouts(sys.argv[2:]))
+    else:
+        asyncio.run(setup_mongo())
+        log_this("SETUP COMPLETE.", "DONE")
@@ -0,0 +1,27 @@
+import asyncio
+
+import uvloop
+
+from app.core.clients import close_clients
+from app.core.logging import log_this
+from app.services.data.stream import build_consumer
+
+# run alongside the API when CLICK_INGESTION_MODE=stream:
+# python -m app.stream_worker
+
+
+async def main():
+    consumer = build_consumer()
+    try:
+        await consumer.run()
+    finally:
+        await consumer.publish_stats()
+        await close_clients()
+
+
+if __name__ == "__main__":
+    uvloop.install()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        log_this("Stream worker stopped.", "DONE")
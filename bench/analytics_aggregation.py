@@ -0,0 +1,119 @@
+"""
+Compares the cache-miss analytics aggregation modes on a synthetic link.
+
+Seeds `--events` raw events into a scratch collection, then times `concurrent` (four pipelines
+with `asyncio.gather`) against `facet` (one `$facet` pipeline), and reports the documents each
+mode examines from `explain`. Hourly rollups for the same events are built for reference. Needs
+the configured Mongo and Redis, the scratch data is dropped afterwards.
+
+    python -m bench.analytics_aggregation --events 200000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import UTC, datetime, timedelta
+
+from app.core.clients import close_clients, db
+from app.services.data.analytics import AnalyticsEngine
+from app.services.data.layout import EventLayout
+from app.services.data.pipelines import RAW_PIPELINES, gen_analytics_facet_pipeline
+from app.services.data.rollups import ROLLUP_COLLECTION, backfill_rollups
+
+LAYOUT = EventLayout("bench_analytics")
+SHORT_URL = "bench-aggregation"
+COUNTRIES = [
+    ("Nigeria", "NG", "Lagos"),
+    ("Ghana", "GH", "Accra"),
+    ("Kenya", "KE", "Nairobi"),
+    ("France", "FR", "Paris"),
+]
+REFERRERS = ["direct", "https://twitter.com", "https://google.com", "https://news.ycombinator.com"]
+
+
+async def seed(events: int) -> None:
+    collection = db.get_collection(LAYOUT.collection)
+    await collection.drop()
+    await collection.create_index([(LAYOUT.short_url, 1), ("timestamp", 1)])
+    start = datetime.now(UTC) - timedelta(days=90)
+    for offset in range(0, events, 10000):
+        batch = []
+        for _ in range(min(10000, events - offset)):
+            country, code, city = random.choice(COUNTRIES)
+            batch.append(
+                {
+                    "short_url": SHORT_URL,
+                    "type": random.choice(["click", "click", "click", "scan"]),
+                    "referer": random.choice(REFERRERS),
+                    "timestamp": start + timedelta(seconds=random.randrange(90 * 24 * 60 * 60)),
+                    "ip_address": f"10.{random.randrange(256)}.{random.randrange(256)}.{random.randrange(256)}",
+                    "os": random.choice(["Linux", "Windows", "iOS", "Android"]),
+                    "device": random.choice(["PC", "iPhone", "Samsung"]),
+                    "browser": random.choice(["Firefox", "Chrome", "Safari"]),
+                    "country": country,
+                    "country_code": code,
+                    "city": city,
+                }
+            )
+        await collection.insert_many(batch, ordered=False)
+
+
+def _docs_examined(explain) -> int:
+    if isinstance(explain, dict):
+        total = explain.get("totalDocsExamined", 0)
+        return total + sum(_docs_examined(value) for value in explain.values())
+    if isinstance(explain, list):
+        return sum(_docs_examined(value) for value in explain)
+    return 0
+
+
+async def docs_examined(pipeline: list[dict]) -> int:
+    explain = await db.command(
+        {
+            "explain": {"aggregate": LAYOUT.collection, "pipeline": pipeline, "cursor": {}},
+            "verbosity": "executionStats",
+        }
+    )
+    return _docs_examined(explain)
+
+
+async def timed(fn, runs: int) -> float:
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fn()
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies) * 1000
+
+
+async def main(events: int, runs: int) -> None:
+    engine = AnalyticsEngine(db)
+    try:
+        await seed(events)
+        concurrent = await timed(lambda: engine._raw_stats_concurrent(SHORT_URL, layout=LAYOUT), runs)
+        facet = await timed(lambda: engine._raw_stats_facet(SHORT_URL, layout=LAYOUT), runs)
+        concurrent_docs = 0
+        for gen_pipeline in RAW_PIPELINES.values():
+            concurrent_docs += await docs_examined(gen_pipeline(SHORT_URL, layout=LAYOUT))
+        facet_docs = await docs_examined(gen_analytics_facet_pipeline(SHORT_URL, layout=LAYOUT))
+        await backfill_rollups(db, layout=LAYOUT)
+        rollups = await timed(lambda: engine._get_rollups(SHORT_URL), runs)
+        hours = await db.get_collection(ROLLUP_COLLECTION).count_documents({"short_url": SHORT_URL})
+
+        print(f"{events} events, median of {runs} runs")
+        print(f"concurrent:  {concurrent:9.1f} ms  {concurrent_docs:10d} docs examined")
+        print(f"facet:       {facet:9.1f} ms  {facet_docs:10d} docs examined")
+        print(f"rollups:     {rollups:9.1f} ms  {hours:10d} docs read")
+    finally:
+        await db.get_collection(LAYOUT.collection).drop()
+        await db.get_collection(ROLLUP_COLLECTION).delete_many({"short_url": SHORT_URL})
+        await close_clients()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.events, args.runs))
@@ -0,0 +1,119 @@
+"""
+Compares end-to-end click ingestion throughput of the Celery task path and the Redis Stream path.
+
+Needs the configured Redis and Mongo, and a running Celery worker for the Celery path
+(`celery -A app.celery worker`). The stream path is consumed in-process. Clicks are recorded for
+`bench-*` short urls, which are removed again afterwards.
+
+    python -m bench.click_ingestion --clicks 20000
+"""
+import argparse
+import asyncio
+import time
+from datetime import UTC, datetime
+
+from app.core.clients import close_clients, db, redis
+from app.services.data.analytics import make_activity
+from app.services.data.layout import analytics_layout
+from app.services.data.rollups import ROLLUP_COLLECTION
+from app.services.data.stream import ClickStream, build_consumer
+from app.services.tasks import track_activity
+
+STREAM_KEY = "bench:stream:clicks"
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:122.0) Gecko/20100101 Firefox/122.0"
+
+
+def _activities(clicks: int, prefix: str) -> list[dict]:
+    return [
+        make_activity(
+            "click",
+            f"{prefix}{i % 100}",
+            "https://example.com",
+            USER_AGENT,
+            f"10.0.{i % 256}.{i % 200}",
+            "https://example.org",
+            datetime.now(UTC),
+        )
+        for i in range(clicks)
+    ]
+
+
+async def _stored(prefix: str) -> int:
+    return await db.get_collection(analytics_layout.collection).count_documents(
+        {analytics_layout.short_url: {"$regex": f"^{prefix}"}}
+    )
+
+
+async def _wait_for(prefix: str, clicks: int, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while await _stored(prefix) < clicks:
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"only {await _stored(prefix)} of {clicks} clicks stored")
+        await asyncio.sleep(0.05)
+
+
+async def bench_celery(clicks: int, timeout: float) -> float:
+    prefix = "bench-celery-"
+    start = time.perf_counter()
+    for activity in _activities(clicks, prefix):
+        track_activity.delay(
+            activity["short_url"],
+            None,
+            activity["original_url"],
+            activity["user_agent_string"],
+            activity["ip_address"],
+            activity["referer"],
+            activity["timestamp"],
+        )
+    await _wait_for(prefix, clicks, timeout)
+    return clicks / (time.perf_counter() - start)
+
+
+async def bench_stream(clicks: int, timeout: float) -> float:
+    prefix = "bench-stream-"
+    producer = ClickStream(redis, STREAM_KEY, maxlen=clicks * 2)
+    consumer = build_consumer("bench", key=STREAM_KEY)
+    await consumer.ensure_group()
+    worker = asyncio.create_task(consumer.run())
+    start = time.perf_counter()
+    activities = _activities(clicks, prefix)
+    for i in range(0, clicks, 500):
+        await producer.track_activities(activities[i : i + 500])
+    try:
+        await _wait_for(prefix, clicks, timeout)
+    finally:
+        worker.cancel()
+    rate = clicks / (time.perf_counter() - start)
+    print(f"Stream batches:  {consumer.batches} (avg {consumer.stats()['avg_batch_size']:.0f} clicks)")
+    return rate
+
+
+async def cleanup() -> None:
+    short_urls = {"$regex": "^bench-"}
+    await db.get_collection(analytics_layout.collection).delete_many({analytics_layout.short_url: short_urls})
+    await db.get_collection(ROLLUP_COLLECTION).delete_many({"short_url": short_urls})
+    await redis.delete(STREAM_KEY, f"{STREAM_KEY}:consumers", f"{STREAM_KEY}:dead")
+    async for key in redis.scan_iter("analytics:bench-*"):
+        await redis.delete(key)
+
+
+async def main(clicks: int, timeout: float, skip_celery: bool) -> None:
+    await cleanup()
+    try:
+        if not skip_celery:
+            celery = await bench_celery(clicks, timeout)
+            print(f"Celery tasks:    {celery:10.0f} clicks/s")
+        stream = await bench_stream(clicks, timeout)
+        print(f"Redis Stream:    {stream:10.0f} clicks/s")
+    finally:
+        await cleanup()
+        await close_clients()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clicks", type=int, default=20000)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--skip-celery", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.clicks, args.timeout, args.skip_celery))
@@ -0,0 +1,96 @@
+"""
+Compares redirect throughput through the FastAPI route and through the raw ASGI fast path.
+
+Both stacks are driven in-process against a warm redirect cache and with activity recording
+disabled, so neither Redis, Mongo nor Celery is needed and the numbers reflect framework
+overhead only.
+
+    python -m bench.redirect_asgi --requests 20000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+import app  # noqa: F401  registers middleware and exception handlers
+from app.core import fastpath
+from app.core.cache.local import redirect_cache
+from app.core.fastpath import RedirectFastPath
+from app.main import app as fastapi_app
+from app.routers import url as url_router
+
+CODES = [f"bench{i}" for i in range(1000)]
+
+
+def _scope(path: str, query: bytes) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query,
+        "root_path": "",
+        "headers": [(b"host", b"localhost:8000"), (b"user-agent", b"bench"), (b"referer", b"")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 8000),
+    }
+
+
+def _receiver():
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # like a real server, only answer again once the client goes away
+        await asyncio.Event().wait()
+
+    return receive
+
+
+async def _run(asgi_app, requests: int) -> float:
+    status = {}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    start = time.perf_counter()
+    for i in range(requests):
+        code = CODES[i % len(CODES)]
+        await asgi_app(_scope(f"/{code}", b"ref=qr" if i % 10 == 0 else b""), _receiver(), send)
+    elapsed = time.perf_counter() - start
+    assert status["code"] == 307, status
+    return requests / elapsed
+
+
+async def main(requests: int) -> None:
+    for code in CODES:
+        redirect_cache.set(code, f"https://example.com/{code}")
+    noop = lambda *args, **kwargs: None
+    url_router.record_activity = noop
+    fastpath.record_activity = noop
+
+    # the process time middleware prints every request body
+    with contextlib.redirect_stdout(io.StringIO()):
+        await _run(fastapi_app, 500)
+        before = await _run(fastapi_app, requests)
+        wrapped = RedirectFastPath(fastapi_app)
+        await _run(wrapped, 500)
+        after = await _run(wrapped, requests)
+    print(f"FastAPI route:   {before:10.0f} req/s")
+    print(f"ASGI fast path:  {after:10.0f} req/s")
+    print(f"Speedup:         {after / before:10.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
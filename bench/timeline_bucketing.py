@@ -0,0 +1,58 @@
+"""
+Compares the NumPy `process_timeline` with the pandas implementation it replaced.
+
+pandas is no longer a runtime dependency, install it separately to run this:
+
+    pip install pandas
+    python -m bench.timeline_bucketing --buckets 2000
+"""
+import argparse
+import random
+import time
+from datetime import UTC, datetime, timedelta
+
+import pandas as pd
+
+from app.services.data.refine import process_timeline
+
+
+def pandas_process_timeline(data: list, interval: str = "h") -> dict:
+    data.append({"timestamp": datetime.now(UTC).isoformat(), "count": 0})
+    df = pd.DataFrame(data)
+    if not df.empty:
+        df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+        df.set_index("timestamp", inplace=True)
+        df = df.fillna(0).resample(interval).sum()
+        df.index = df.index.to_series().apply(lambda x: x.isoformat())  # type: ignore
+    return df.to_dict()
+
+
+def _data(buckets: int) -> list[dict]:
+    # hourly buckets as returned by the timeline pipeline, with gaps
+    now = datetime.now(UTC).replace(minute=0, second=0, microsecond=0, tzinfo=None)
+    hours = random.sample(range(buckets * 2), buckets)
+    return [{"timestamp": now - timedelta(hours=hour), "count": random.randrange(1, 100)} for hour in hours]
+
+
+def timed(fn, data: list[dict], interval: str, runs: int) -> float:
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn(list(data), interval)
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def main(buckets: int, runs: int) -> None:
+    data = _data(buckets)
+    for interval in ("h", "d"):
+        assert process_timeline(list(data), interval) == pandas_process_timeline(list(data), interval)
+        numpy_ms = timed(process_timeline, data, interval, runs)
+        pandas_ms = timed(pandas_process_timeline, data, interval, runs)
+        print(f"{interval}: pandas {pandas_ms:8.2f} ms  numpy {numpy_ms:8.2f} ms  ({pandas_ms / numpy_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--buckets", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+    main(args.buckets, args.runs)